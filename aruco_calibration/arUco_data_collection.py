@@ -3,6 +3,14 @@ import robotic as ry
 import numpy as np
 from robotic.src.h5_helper import H5Writer, H5Reader
 import json
+import sys
+from pathlib import Path
+from marker_tracking import TrackingDetector
+
+sys.path.append(str(Path(__file__).parent.parent))
+from common.camera_capture import CameraCapture, SerializedBot
+from common.pcl_preprocessing import preprocess
+from common.recording import open_bot
 
 # TODO: Ground truth
 
@@ -14,36 +22,42 @@ aruco_params.cornerRefinementMethod = aruco.CORNER_REFINE_SUBPIX
 NUMBER_OF_POSES = 20
 MIN_DISTANCE = 0.2
 MAX_DISTANCE = 0.8
+PREVIEW_MAX_POINTS = 50_000 # the preview pointcloud is decimated to this many points
 
 C = ry.Config()
 C.addFile(ry.raiPath("scenarios/pandaSingle_camera.g"))
-bot = ry.BotOp(C, True)
+bot = SerializedBot(open_bot(C, True)) # shared with the capture thread
 pcl = C.addFrame("pcl", "l_cameraWrist")
 bot.getImageAndDepth('l_cameraWrist') # initialize camera
 
 h5 = H5Writer('aruco_calibration_data.h5')
+tracker = TrackingDetector(aruco_6x6) # only for the live preview, the capture below searches the full frame
+camera = CameraCapture(bot, 'l_cameraWrist').start() # preview frames, processed at camera rate
 
 markers = set()
 i = 0
 while i < NUMBER_OF_POSES:
     bot.hold(floating=True, damping=False)
+    last_frame = -1
+    viewmsg = "waiting for camera"
     while bot.getKeyPressed() != ord('q'):
-        rgb, _, points = bot.getImageDepthPcl("l_cameraWrist")
-        corners, ids, _ = aruco.detectMarkers(rgb, aruco_6x6)
-        points = points.reshape(-1,3)
-        rgb = rgb.reshape(-1,3)
-        mask = (np.linalg.norm(points, axis=-1) > MIN_DISTANCE) & (np.linalg.norm(points, axis=-1) < MAX_DISTANCE)
-        pcl.setPointCloud(points[mask], rgb[mask])
-        if ids is not None:
-            viewmsg = f"visible markers: {ids.squeeze().tolist()}\nmove to a new pose and press 'q' to capture"
-        else:
-            viewmsg = f"no markers visible\nmove to a new pose and press 'q' to capture"
+        frame = camera.latest()
+        if frame is not None and frame.index != last_frame:
+            last_frame = frame.index
+            corners, ids, _ = tracker.detect(frame.rgb)
+            pcl.setPointCloud(*preprocess(frame.points, MIN_DISTANCE, MAX_DISTANCE, frame.rgb, PREVIEW_MAX_POINTS))
+            if ids is not None:
+                viewmsg = f"visible markers: {ids.squeeze().tolist()}\nmove to a new pose and press 'q' to capture"
+            else:
+                viewmsg = f"no markers visible\nmove to a new pose and press 'q' to capture"
         bot.sync(C, viewMsg=viewmsg)
     
     bot.hold(floating=False)
     bot.sync(C)
     joint_state = C.getJointState()
-    rgb, _, points = bot.getImageDepthPcl("l_cameraWrist")
+    # a frame captured after the sync, so it matches the joint state, the capture thread owns the camera
+    frame = camera.next_frame()
+    rgb, points = frame.rgb, frame.points
     corners, ids, _ = aruco.detectMarkers(rgb, aruco_6x6, parameters=aruco_params)
 
     if ids is None:
@@ -61,6 +75,7 @@ while i < NUMBER_OF_POSES:
     h5.write(key+'/ids', ids.flatten(), dtype='int32')
     i += 1
 
+camera.stop()
 del bot
 del C
 
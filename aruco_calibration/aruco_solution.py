@@ -0,0 +1,201 @@
+# Hand-eye calibration of the wrist camera from the ArUco dataset written by automatic_aruco_data_collection.py.
+# Every marker observation (p_x, p_y, d) is back-projected into the camera frame (rai convention, the camera
+# looks along -z), transformed into l_panda_base with the forward kinematics of its pose and compared with the
+# ground truth marker position from marker_gt_new.h5. The residuals of all poses and markers are evaluated in one
+# vectorized pass. Unknowns are the camera pose relative to PARENT_FRAME, optionally the intrinsics and the height
+# of every marker (the ground truth only contains x and y). Older datasets only store the first corner of each marker
+# (marker_positions) while the ground truth is the marker center, for these the in-plane yaw of every marker is
+# estimated as well and the ground truth is shifted to the first corner, half a MARKER_SIZE along each marker axis.
+# A residual only depends on the camera pose, the intrinsics and the height (and yaw) of its own marker, this sparsity
+# is passed to least_squares, so the finite difference Jacobian needs one evaluation per dense column plus one for
+# all marker heights (and yaws) together. The resulting Q is relative to PARENT_FRAME, the parent of cameraWrist in
+# the g-file, so the printed Edit line can be pasted as is.
+
+import time
+import sys
+import numpy as np
+import robotic as ry
+from robotic.src import h5_helper
+from pathlib import Path
+from scipy.optimize import least_squares
+from scipy.sparse import lil_matrix
+from scipy.spatial.transform import Rotation
+
+root = Path(__file__).parent.parent
+sys.path.append(str(root))
+from common.kinematics_cache import KinematicsCache, cache_file
+
+DATA_FILE = root / 'data' / 'aruco_calibration_data_v2.h5'
+GT_FILE = root / 'data' / 'marker_gt_new.h5'
+PARENT_FRAME = 'l_panda_joint7' # parent of cameraWrist, the resulting Q is relative to this frame
+FXYCXY = None # intrinsics for datasets without camera_fxycxy in the manifest
+OPTIMIZE_INTRINSICS = False
+LOSS = 'soft_l1' # robust loss, outlier detections should not pull the solution
+F_SCALE = 0.01 # m, residuals above this are treated as outliers by the robust loss
+KEYPOINT = 4 # which marker keypoint is compared with the ground truth, 4 is the center
+MARKER_SIZE = .05 # side length in m, for datasets that only contain the first corner
+
+
+def load_data(C, filename=DATA_FILE, gt_filename=GT_FILE):
+    # returns the base to PARENT_FRAME transforms (P, 4, 4), the camera pose of the g-file relative to PARENT_FRAME
+    # (4, 4), the observations (K, 3), their pose and marker indices (K,),
+    # the ground truth marker xy (M, 2), the marker ids (M,), the intrinsics from the manifest and whether the
+    # observations are first corners instead of centers
+    gt = h5_helper.H5Reader(gt_filename)
+    marker_ids = gt.read_dict('manifest')['marker_ids']
+    gt_xy = np.array([gt.read(f'marker_{id}/position')[:2] for id in marker_ids])
+    marker_index = {id: j for j, id in enumerate(marker_ids)}
+
+    h5 = h5_helper.H5Reader(filename)
+    manifest = h5.read_dict('manifest')
+    fxycxy = manifest.get('camera_fxycxy', FXYCXY)
+    if fxycxy is None:
+        raise ValueError("No camera intrinsics in the manifest, set FXYCXY")
+
+    joint_states, observations, pose_idx, marker_idx = [], [], [], []
+    corners = None
+    for i in range(manifest['n_datasets']):
+        key = f'dataset_{i}'
+        if key not in h5.fil:
+            continue
+        if corners is None:
+            corners = key + '/marker_keypoints' not in h5.fil
+        keypoints = h5.read(key + '/marker_positions') if corners else h5.read(key + '/marker_keypoints')[:, KEYPOINT]
+        ids = h5.read(key + '/marker_ids')
+        keep = np.all(np.isfinite(keypoints), axis=1) & np.isin(ids, marker_ids)
+        if not np.any(keep):
+            continue
+
+        joint_states.append(h5.read(key + '/joint_state'))
+        observations.append(keypoints[keep])
+        pose_idx.append(np.full(keep.sum(), len(joint_states) - 1))
+        marker_idx.append([marker_index[id] for id in ids[keep]])
+
+    fk = KinematicsCache(C, joint_states, cache_file(filename))
+    transforms = fk.relative(PARENT_FRAME, to='l_panda_base')
+    camera = fk.relative('l_cameraWrist', to=PARENT_FRAME)[0]
+    return transforms, camera, np.concatenate(observations).astype(np.float64), np.concatenate(pose_idx), \
+        np.concatenate(marker_idx), gt_xy, np.array(marker_ids), np.array(fxycxy, dtype=np.float64), bool(corners)
+
+
+def back_project(observations, fxycxy):
+    # (p_x, p_y, d) -> points in the camera frame
+    fx, fy, cx, cy = fxycxy
+    d = observations[:, 2]
+    return np.stack([d * (observations[:, 0] - cx) / fx, -d * (observations[:, 1] - cy) / fy, -d], axis=1)
+
+
+def unpack(x, fxycxy, n_markers, corners=False):
+    # x = (rotvec, t, [fxycxy], marker heights, [marker yaws])
+    R = Rotation.from_rotvec(x[:3]).as_matrix()
+    t = x[3:6]
+    if x.shape[0] > 6 + n_markers * (1 + corners):
+        fxycxy = x[6:10]
+    yaw = x[-n_markers:] if corners else None
+    z = x[-n_markers * (1 + corners):][:n_markers]
+    return R, t, fxycxy, z, yaw
+
+
+def corner_offsets(yaw):
+    # first corner relative to the marker center in the table plane, (-s/2, s/2) in the marker frame
+    a, b = -MARKER_SIZE / 2, MARKER_SIZE / 2
+    return np.stack([np.cos(yaw) * a - np.sin(yaw) * b, np.sin(yaw) * a + np.cos(yaw) * b], axis=-1)
+
+
+def residuals(x, transforms, observations, pose_idx, marker_idx, gt_xy, fxycxy, corners=False):
+    # (K * 3,) differences between the observed and the ground truth marker positions in l_panda_base
+    R, t, fxycxy, z, yaw = unpack(x, fxycxy, gt_xy.shape[0], corners)
+    p_parent = back_project(observations, fxycxy) @ R.T + t
+    T = transforms[pose_idx]
+    p_base = np.einsum('kij,kj->ki', T[:, :3, :3], p_parent) + T[:, :3, 3]
+    xy = gt_xy + corner_offsets(yaw) if corners else gt_xy
+    gt = np.hstack([xy[marker_idx], z[marker_idx, None]])
+    return (p_base - gt).ravel()
+
+
+def jacobian_sparsity(marker_idx, n_dense, n_markers, corners=False):
+    # every residual depends on the dense camera parameters, only the z residual on the height of its marker and
+    # the x and y residuals on the yaw of its marker
+    K = marker_idx.shape[0]
+    S = lil_matrix((3 * K, n_dense + n_markers * (1 + corners)), dtype=int)
+    S[:, :n_dense] = 1
+    S[3 * np.arange(K) + 2, n_dense + marker_idx] = 1
+    if corners:
+        S[3 * np.arange(K), n_dense + n_markers + marker_idx] = 1
+        S[3 * np.arange(K) + 1, n_dense + n_markers + marker_idx] = 1
+    return S
+
+
+def solve(transforms, observations, pose_idx, marker_idx, gt_xy, fxycxy, x0_pose, corners=False,
+          optimize_intrinsics=OPTIMIZE_INTRINSICS, loss=LOSS, f_scale=F_SCALE):
+    # x0_pose (7,) initial camera pose relative to PARENT_FRAME as [x, y, z, qw, qx, qy, qz]
+    start = time.perf_counter()
+    n_markers = gt_xy.shape[0]
+    rotvec = Rotation.from_quat(np.roll(x0_pose[3:], -1)).as_rotvec()
+    x0 = [rotvec, x0_pose[:3]]
+    if optimize_intrinsics:
+        x0.append(fxycxy)
+    n_dense = 6 + 4 * optimize_intrinsics
+
+    # initial marker heights (and yaws from the direction of the first corners) from the back-projected observations
+    R, t, _, _, _ = unpack(np.concatenate(x0 + [np.zeros(n_markers)]), fxycxy, n_markers)
+    p_parent = back_project(observations, fxycxy) @ R.T + t
+    T = transforms[pose_idx]
+    p_base = np.einsum('kij,kj->ki', T[:, :3, :3], p_parent) + T[:, :3, 3]
+    seen = [marker_idx == j for j in range(n_markers)]
+    x0.append(np.array([np.median(p_base[m, 2]) if np.any(m) else 0. for m in seen]))
+    if corners:
+        offsets = np.array([np.median(p_base[m, :2], axis=0) - gt_xy[j] if np.any(m) else corner_offsets(0.)
+                            for j, m in enumerate(seen)])
+        x0.append(np.arctan2(offsets[:, 1], offsets[:, 0]) - np.arctan2(1, -1))
+
+    result = least_squares(residuals, np.concatenate(x0),
+                           jac_sparsity=jacobian_sparsity(marker_idx, n_dense, n_markers, corners),
+                           loss=loss, f_scale=f_scale, x_scale='jac',
+                           args=(transforms, observations, pose_idx, marker_idx, gt_xy, fxycxy, corners))
+    R, t, fxycxy, z, yaw = unpack(result.x, fxycxy, n_markers, corners)
+    r = result.fun.reshape(-1, 3)
+    info = {
+        'evaluations': result.nfev,
+        'rms': np.sqrt(np.mean(np.sum(r**2, axis=1))),
+        'median': np.median(np.linalg.norm(r, axis=1)),
+        'time': time.perf_counter() - start,
+        'fxycxy': fxycxy,
+        'marker_heights': z,
+        'marker_yaws': yaw
+    }
+    return R, t, info
+
+
+def get_Q(R, t):
+    q = Rotation.from_matrix(R).as_quat()
+    return np.round(t, 8).tolist() + np.round(np.roll(q, 1), 8).tolist()
+
+
+def main():
+    C = ry.Config()
+    C.addFile(ry.raiPath("scenarios/pandaSingle_camera.g"))
+
+    start = time.perf_counter()
+    transforms, camera, observations, pose_idx, marker_idx, gt_xy, marker_ids, fxycxy, corners = load_data(C)
+    print(f'loaded {observations.shape[0]} observations of {len(marker_ids)} markers in {transforms.shape[0]} poses '
+          f'in {time.perf_counter() - start:.3f}s')
+
+    # the camera pose of the g-file as initial guess
+    x0_pose = np.array(get_Q(camera[:3, :3], camera[:3, 3]))
+
+    if corners:
+        print('no marker centers in the dataset, fitting the first corners with a yaw per marker')
+    R, t, info = solve(transforms, observations, pose_idx, marker_idx, gt_xy, fxycxy, x0_pose, corners)
+    print(f"solved in {info['time']:.3f}s ({info['evaluations']} evaluations), "
+          f"rms error {info['rms']:.4f}m, median {info['median']:.4f}m")
+    if OPTIMIZE_INTRINSICS:
+        print(f"intrinsics: {np.round(info['fxycxy'], 3).tolist()}")
+    for id, z in zip(marker_ids, info['marker_heights']):
+        print(f'marker {id} height: {z:.4f}')
+
+    print(f'Edit cameraWrist: {{ Q: {get_Q(R, t)} }}')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,25 @@ from robotic.src import h5_helper
 from cv2 import aruco
 from pathlib import Path
 import matplotlib.pyplot as plt
+import sys
+import queue
+import threading
+import itertools
+import time
 
 aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_6X6_100)
 aruco_params = aruco.DetectorParameters_create()
 aruco_params.cornerRefinementMethod = aruco.CORNER_REFINE_SUBPIX
 root = Path(__file__).parent.parent
+sys.path.append(str(root))
+from common.pose_planner import PosePlanner
+from common.pose_ordering import plan_ordered, travel_time
+from common.ik_cache import IKCache
+from common.reachability import ReachabilityMap, MAP_FILE
+from common.recording import open_bot
+from marker_depth import marker_keypoints, sample_marker_depths
+from marker_aggregation import MarkerAggregator
+from marker_tracking import TrackingDetector
 
 NUMBER_OF_POSES = 100
 IMAGES_PER_POSE = 10
@@ -19,44 +33,170 @@ MIN_DISTANCE = .2
 MAX_DISTANCE = .7
 MAX_TARGET_OFFSET = 0.1
 SEED = 0
+ORDER_POSES = True # plan NUMBER_OF_POSES poses up front and visit them in travel time optimized order
+IK_CACHE_FILE = root / 'data' / 'ik_cache.json' # None to disable the cache
+REACHABILITY_FILE = MAP_FILE # built by common/reachability.py, None to disable
+PIPELINED = True # process and write the frames of a pose in background threads while the robot moves on
 
 
-def look_with_angle(C, target_name, distance, angle):
-    komo = ry.KOMO(C, 1, 1, 0, True)
-    
-    komo.addControlObjective([], 0, 1e-1)
+def sample_target(C, rng, marker_ids):
+    marker_id = rng.choice(marker_ids)
+    offset = rng.random(2) * MAX_TARGET_OFFSET
+    target_position = C.getFrame(f'marker_{marker_id}').getPosition() + np.concatenate([offset, [0]])
 
-    height = distance * np.cos(angle)
+    angle = rng.random(1)[0] * (MAX_ANGLE - MIN_ANGLE) + MIN_ANGLE
+    distance = rng.random(1)[0] * ( MAX_DISTANCE - MIN_DISTANCE) + MIN_DISTANCE
+    return target_position, distance, angle
 
-    komo.addObjective([], ry.FS.accumulatedCollisions, [], ry.OT.eq, [1])
-    komo.addObjective([], ry.FS.negDistance, ['l_cameraWrist', target_name], ry.OT.eq, [1], [-distance]) 
-    komo.addObjective([], ry.FS.jointLimits, [], ry.OT.ineq)
 
-    komo.addObjective([], ry.FS.positionDiff, ['l_cameraWrist', target_name], ry.OT.eq, [0,0,1], [0,0,height])
-    # point camera at target
-    komo.addObjective([], ry.FS.positionRel, [target_name, 'l_cameraWrist'], ry.OT.eq, [[1,0,0],[0,1,0]])
+def detect_markers(rgb, detector=None):
+    # returns the ids and the (markers, 5, 2) sub-pixel corners (CORNER_REFINE_SUBPIX) and centers of all detected
+    # markers
+    corners, ids, _ = aruco.detectMarkers(rgb, aruco_dict, parameters=aruco_params) if detector is None \
+        else detector.detect(rgb)
+    if ids is None:
+        return np.zeros(0, dtype=np.int32), marker_keypoints([])
+    return ids.flatten(), marker_keypoints(corners)
 
-    return komo
 
+class CollectionPipeline:
+    # Processes the captured frames in the stages detection -> depth sampling and aggregation per pose -> h5 write.
+    # If threaded, every stage runs in its own thread connected by bounded queues, so the main loop can move the
+    # robot to the next pose while the previous one is processed. Otherwise the stages run directly in submit,
+    # which is the old sequential behaviour. Both write identical files. An exception in a stage is kept in error,
+    # the stages then only drain their queues so the producer never blocks, and it is re-raised in submit and close.
+    def __init__(self, h5, n_datasets, frames_per_pose, threaded=True):
+        self.h5 = h5
+        self.n_datasets = n_datasets
+        self.frames_per_pose = frames_per_pose
+        self.threaded = threaded
+        self.n_written = 0
+        self.marker_set = set()
+        self.done = threading.Event() # set once n_datasets datasets are written
+        self.pose_joint_states = []
+        self.pose_ids = []
+        self.pose_keypoints = []
+        self.pose_depths = []
+        self.aggregator = MarkerAggregator(frames_per_pose)
+        # the camera is static during the frames of a pose, so only the first one is searched completely
+        self.detector = TrackingDetector(aruco_dict, aruco_params, redetect_every=frames_per_pose)
+        self.n_detected = 0
+        self.error = None
 
-def bilinear_depth_interpolation(depth, x, y):
-    x0 = int(np.floor(x))
-    x1 = min(x0 + 1, depth.shape[1] - 1)
-    y0 = int(np.floor(y))
-    y1 = min(y0 + 1, depth.shape[0] - 1)
+        self.stages = [self._detect, self._aggregate, self._write]
+        if threaded:
+            self.queues = [queue.Queue(maxsize=frames_per_pose) for _ in self.stages]
+            self.threads = []
+            for j, stage in enumerate(self.stages):
+                q_out = self.queues[j + 1] if j + 1 < len(self.stages) else None
+                thread = threading.Thread(target=self._run, args=(stage, self.queues[j], q_out), daemon=True)
+                thread.start()
+                self.threads.append(thread)
 
-    Q11 = depth[y0, x0]
-    Q21 = depth[y0, x1]
-    Q12 = depth[y1, x0]
-    Q22 = depth[y1, x1]
+    def _detect(self, item):
+        joint_state, rgb, depth = item
+        if self.n_detected % self.frames_per_pose == 0:
+            self.detector.reset()
+        self.n_detected += 1
+        return joint_state, *detect_markers(rgb, self.detector), depth
 
-    if np.isnan(Q11) or np.isnan(Q21) or np.isnan(Q12) or np.isnan(Q22):
-        return np.nan
+    def _aggregate(self, item):
+        joint_state, ids, keypoints, depth = item
+        self.pose_joint_states.append(joint_state)
+        self.pose_ids.append(ids)
+        self.pose_keypoints.append(keypoints)
+        self.pose_depths.append(depth)
+        if len(self.pose_depths) < self.frames_per_pose:
+            return None
+        # one sampling call for all keypoints of all frames of the pose
+        observations, valid = sample_marker_depths(np.stack(self.pose_depths), self.pose_keypoints)
+        frame_idx = np.repeat(np.arange(self.frames_per_pose), [len(ids) for ids in self.pose_ids])
+        self.aggregator.reset()
+        self.aggregator.add(frame_idx, np.concatenate(self.pose_ids), observations, valid)
+        result = (self.pose_joint_states, self.aggregator.reduce())
+        self.pose_joint_states = []
+        self.pose_ids = []
+        self.pose_keypoints = []
+        self.pose_depths = []
+        return result
 
-    return (Q11 * (x1 - x) * (y1 - y) +
-            Q21 * (x - x0) * (y1 - y) +
-            Q12 * (x1 - x) * (y - y0) +
-            Q22 * (x - x0) * (y - y0))
+    def _write(self, item):
+        joint_states, aggregated = item
+        if aggregated is None or self.done.is_set():
+            return None
+        ids = aggregated['ids'].tolist()
+        i = self.n_written
+        self.marker_set.update(ids)
+        print(f'dataset {i}, {ids=}')
+        self.h5.write(f'dataset_{i}/joint_state', np.mean(joint_states, axis=0), dtype='float64')
+        self.h5.write(f'dataset_{i}/marker_positions', aggregated['mean'][:, 0], dtype='float32')
+        self.h5.write(f'dataset_{i}/marker_keypoints', aggregated['mean'], dtype='float32')
+        self.h5.write(f'dataset_{i}/marker_keypoints_median', aggregated['median'], dtype='float32')
+        self.h5.write(f'dataset_{i}/marker_keypoints_mad', aggregated['mad'], dtype='float32')
+        self.h5.write(f'dataset_{i}/marker_counts', aggregated['counts'], dtype='int32')
+        self.h5.write(f'dataset_{i}/marker_ids', np.array(ids), dtype='int32')
+        self.n_written += 1
+        if self.n_written == self.n_datasets:
+            self.done.set()
+        return None
+
+    def _run(self, stage, q_in, q_out):
+        # None is passed down the stages to shut them down
+        while (item := q_in.get()) is not None:
+            if self.error is not None:
+                continue
+            try:
+                result = stage(item)
+            except Exception as e:
+                self.error = e
+                continue
+            if result is not None and q_out is not None:
+                q_out.put(result)
+        if q_out is not None:
+            q_out.put(None)
+
+    def submit(self, joint_state, rgb, depth):
+        item = (joint_state, rgb, depth)
+        if self.error is not None:
+            raise self.error
+        if self.threaded:
+            self.queues[0].put(item)
+            return
+        for stage in self.stages:
+            item = stage(item)
+            if item is None:
+                break
+
+    def close(self):
+        # waits until all submitted frames are processed
+        if self.threaded:
+            self.queues[0].put(None)
+            for thread in self.threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def write_manifest(h5, n_datasets, marker_set, camera_fxycxy):
+    manifest = {
+    'description': 'for various poses: joint state of the panda and ids and and positions (first corner) of arUco markers as (p_x, p_y, d) coordinates. marker_keypoints contains all four corners and the center of each marker (p_x, p_y sub-pixel, d bilinearly interpolated), averaged over the frames after outlier rejection, with their median, MAD and the number of frames each marker was detected in. camera_fxycxy are the intrinsics of the wrist camera. The parameters entry contains the parameters used for data collection.',
+    'n_datasets': n_datasets, # the datasets actually written, fewer if the collection failed
+    'marker_ids': [int(id) for id in marker_set],
+    'camera_fxycxy': camera_fxycxy,
+    'keys': ['manifest', 'dataset_[i]/joint_state', 'dataset_[i]/marker_positions', 'dataset_[i]/marker_keypoints', 'dataset_[i]/marker_keypoints_median', 'dataset_[i]/marker_keypoints_mad', 'dataset_[i]/marker_counts', 'dataset_[i]/marker_ids'],
+    'parameters': {
+        'NUMBER_OF_POSES': NUMBER_OF_POSES,
+        'IMAGES_PER_POSE': IMAGES_PER_POSE,
+        'MIN_DISTANCE': MIN_DISTANCE,
+        'MAX_DISTANCE': MAX_DISTANCE,
+        'MIN_ANGLE': MIN_ANGLE,
+        'MAX_ANGLE': MAX_ANGLE,
+        'MAX_TARGET_OFFSET': MAX_TARGET_OFFSET,
+        'SEED': SEED,
+        'ORDER_POSES': ORDER_POSES
+        }
+    }
+    h5.write('manifest', bytearray(json.dumps(manifest), 'utf-8'), dtype='int8')
 
 
 def main():
@@ -76,94 +216,63 @@ def main():
 
     h5 = h5_helper.H5Writer(root / 'data' /'aruco_calibration_data_v2.h5')
 
-    bot = ry.BotOp(C, True)
+    bot = open_bot(C, True)
     bot.getImageAndDepth('l_cameraWrist') # initialize camera
 
     target = C.addFrame('target')
 
     rng = np.random.default_rng(SEED)
 
-    marker_set = set()
-    
-    i = 0
-
-    while i < NUMBER_OF_POSES:
-        marker_id = rng.choice(manifest['marker_ids'])
-        offset = rng.random(2) * MAX_TARGET_OFFSET
-        target.setPosition(C.getFrame(f'marker_{marker_id}').getPosition() + np.concatenate([offset, [0]]))
-
-        angle = rng.random(1)[0] * (MAX_ANGLE - MIN_ANGLE) + MIN_ANGLE
-        distance = rng.random(1)[0] * ( MAX_DISTANCE - MIN_DISTANCE) + MIN_DISTANCE
-
-        komo = look_with_angle(C, 'target', distance, angle)
-        ret = ry.NLP_Solver(komo.nlp(), verbose=-1).solve()
-        if not ret.feasible:
-            continue
-        path = komo.getPath()
-
-        bot.moveTo(path[-1])
-        bot.wait(C)
-        bot.hold(floating=False)
-
-        coords = dict()
-        count = dict()
-        joint_states = []
-        for _ in range(IMAGES_PER_POSE):
-            joint_states.append(C.getJointState())
-            rgb, depth = bot.getImageAndDepth("l_cameraWrist")
-            corners, ids, _ = aruco.detectMarkers(rgb, aruco_dict)
-            if ids is None:
-                continue
-            for id, corner in zip(ids.flatten(), corners):
-                pixel_coord = corner[0, 0, :].astype(int)
-                d = bilinear_depth_interpolation(depth, pixel_coord[0], pixel_coord[1])
-                if id not in coords:
-                    coords[id] = np.concatenate([corner[0, 0, :], [d]])
-                    count[id] = 1
-                else:
-                    coords[id] += np.concatenate([corner[0, 0, :], [d]])
-                    count[id] += 1
-            
-        if len(coords) == 0:
-            continue
-        
-        corners = []
-        ids = []
-        for id in coords:
-            if count[id] < 3:
-                continue
-            coords[id] /= count[id]
-            corners.append(coords[id])
-            ids.append(id)
-            marker_set.add(id)
+    cache = IKCache(IK_CACHE_FILE) if IK_CACHE_FILE is not None else None
+    reachability = None
+    if REACHABILITY_FILE is not None and Path(REACHABILITY_FILE).is_file():
+        reachability = ReachabilityMap.load(REACHABILITY_FILE)
+    sampler = lambda: sample_target(C, rng, manifest['marker_ids'])
+    with PosePlanner(sampler, cache=cache, reachability=reachability) as planner: # the pool is closed on errors
+        pipeline = CollectionPipeline(h5, NUMBER_OF_POSES, IMAGES_PER_POSE, threaded=PIPELINED)
+        poses = planner
+        if ORDER_POSES:
+            # poses without markers don't produce a dataset, these are replaced by further (unordered) poses
+            poses = itertools.chain(plan_ordered(planner, NUMBER_OF_POSES, C.getJointState()), planner)
 
-        print(f'dataset {i}, {ids=}')
-        h5.write(f'dataset_{i}/joint_state', np.mean(joint_states, axis=0), dtype='float64')
-        h5.write(f'dataset_{i}/marker_positions', np.array(corners), dtype='float32')
-        h5.write(f'dataset_{i}/marker_ids', np.array(ids), dtype='int32')
+        camera_fxycxy = [float(v) for v in bot.getCameraFxycxy('l_cameraWrist')]
+        estimated_motion_time = 0
+        motion_time = 0
+
+        try:
+            for q, (target_position, _, _) in poses:
+                if pipeline.done.is_set():
+                    break
+                target.setPosition(target_position)
+
+                estimated_motion_time += travel_time(C.getJointState(), q)
+                start = time.time()
+                bot.moveTo(q)
+                bot.wait(C)
+                motion_time += time.time() - start
+                bot.hold(floating=False)
 
-        i += 1
-        
+                for _ in range(IMAGES_PER_POSE):
+                    joint_state = C.getJointState()
+                    rgb, depth = bot.getImageAndDepth("l_cameraWrist")
+                    pipeline.submit(joint_state, rgb, depth)
+
+                if pipeline.done.is_set():
+                    break
+        finally:
+            # the manifest is written even if the robot or a pipeline stage failed, so the datasets written so far
+            # stay readable
+            try:
+                pipeline.close()
+            finally:
+                write_manifest(h5, pipeline.n_written, pipeline.marker_set, camera_fxycxy)
+    print(planner.summary())
+    if cache is not None:
+        cache.save()
+        print(cache.summary())
+    print(f'motion time: estimated {estimated_motion_time:.1f}s, actual {motion_time:.1f}s')
     del bot
     del C
 
-    manifest = {
-    'description': 'for various poses: joint state of the panda and ids and and positions (first corner) of arUco markers as (p_x, p_y, d) coordinates. The parameters entry contains the parameters used for data collection.',
-    'n_datasets': NUMBER_OF_POSES,
-    'marker_ids': list(marker_set),
-    'keys': ['manifest', 'dataset_[i]/joint_state', 'dataset_[i]/marker_positions', 'dataset_[i]/marker_ids'],
-    'parameters': {
-        'NUMBER_OF_POSES': NUMBER_OF_POSES,
-        'IMAGES_PER_POSE': IMAGES_PER_POSE,
-        'MIN_DISTANCE': MIN_DISTANCE,
-        'MAX_DISTANCE': MAX_DISTANCE,
-        'MIN_ANGLE': MIN_ANGLE,
-        'MAX_ANGLE': MAX_ANGLE,
-        'MAX_TARGET_OFFSET': MAX_TARGET_OFFSET,
-        'SEED': SEED
-        }
-    }
-    h5.write('manifest', bytearray(json.dumps(manifest), 'utf-8'), dtype='int8')
-
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,59 @@
+# Aggregation of the marker observations of all frames taken at one pose. The observations are written into a
+# preallocated (frames x marker ids x keypoints x 3) array, missing detections and invalid depths are nan.
+# reduce computes median, MAD, outlier-rejected mean and the number of detections for every marker seen often
+# enough in one vectorized pass, so a single bad depth pixel no longer corrupts the average of a marker.
+
+import warnings
+import numpy as np
+from marker_depth import N_KEYPOINTS
+
+
+N_MARKER_IDS = 100 # DICT_6X6_100
+MIN_OBSERVATIONS = 3 # a marker has to be detected in this many frames to be kept
+OUTLIER_THRESHOLD = 3. # in robust standard deviations, sigma = 1.4826 * MAD
+MAD_TO_STD = 1.4826
+MIN_SIGMA = np.array([.5, .5, .002], dtype=np.float32) # (p_x, p_y in pixels, d in m), the MAD of few frames can be tiny
+
+
+class MarkerAggregator:
+    def __init__(self, n_frames, n_marker_ids=N_MARKER_IDS, n_keypoints=N_KEYPOINTS):
+        self.observations = np.full((n_frames, n_marker_ids, n_keypoints, 3), np.nan, dtype=np.float32)
+        self.detected = np.zeros((n_frames, n_marker_ids), dtype=bool)
+
+    def reset(self):
+        self.observations.fill(np.nan)
+        self.detected.fill(False)
+
+    def add(self, frame_idx, marker_ids, observations, valid):
+        # adds all detections (d,) of a pose at once, observations (d, keypoints, 3) with validity (d, keypoints)
+        # only the depth of an invalid sample is dropped, its pixel coordinates are still valid
+        self.observations[frame_idx, marker_ids] = observations
+        self.observations[frame_idx, marker_ids, :, 2] = np.where(valid, observations[..., 2], np.nan)
+        self.detected[frame_idx, marker_ids] = True
+
+    def reduce(self, min_observations=MIN_OBSERVATIONS, threshold=OUTLIER_THRESHOLD):
+        # returns None if nothing was detected, else a dict with the marker ids and per marker statistics of
+        # shape (markers, keypoints, 3): mean (without outliers), median, mad and the detection count per marker
+        counts = self.detected.sum(axis=0)
+        if not np.any(counts):
+            return None
+        ids = np.flatnonzero(counts >= min_observations)
+        X = self.observations[:, ids]
+
+        with warnings.catch_warnings():
+            # all nan slices (e.g. a keypoint without any valid depth) are expected and stay nan
+            warnings.simplefilter('ignore', RuntimeWarning)
+            median = np.nanmedian(X, axis=0)
+            deviation = np.abs(X - median)
+            mad = np.nanmedian(deviation, axis=0)
+            outlier = deviation > threshold * np.maximum(MAD_TO_STD * mad, MIN_SIGMA)
+            mean = np.nanmean(np.where(outlier, np.nan, X), axis=0)
+
+        return {
+            'ids': ids,
+            'mean': mean,
+            'median': median,
+            'mad': mad,
+            'counts': counts[ids],
+            'n_inliers': np.sum(np.isfinite(X) & ~outlier, axis=0)
+        }
@@ -0,0 +1,55 @@
+# Vectorized sub-pixel depth sampling for ArUco markers. Instead of looking up the depth of one (rounded) corner
+# per marker and frame, all four corners and the center of every detected marker in all frames of a pose are
+# bilinearly interpolated in the stacked depth images with a single call.
+
+import numpy as np
+
+
+N_KEYPOINTS = 5 # 4 corners + center
+
+
+def marker_keypoints(corners):
+    # corners as returned by aruco.detectMarkers (list of (1, 4, 2) arrays) -> (markers, 5, 2) pixel coordinates
+    if len(corners) == 0:
+        return np.zeros((0, N_KEYPOINTS, 2), dtype=np.float32)
+    corners = np.concatenate(corners, axis=0)
+    return np.concatenate([corners, corners.mean(axis=1, keepdims=True)], axis=1)
+
+
+def sample_depth(depths, frame_idx, pixels):
+    # Bilinear interpolation of depths (frames, H, W) at the sub-pixel coordinates pixels (k, 2) given as (x, y)
+    # in the frames frame_idx (k,). Returns the depths (k,) and a validity mask (k,), a sample is invalid if it
+    # lies outside of the image or if one of its 4 neighbouring pixels has no depth (nan or 0).
+    H, W = depths.shape[1:]
+    x = pixels[:, 0].astype(np.float64)
+    y = pixels[:, 1].astype(np.float64)
+    inside = (x >= 0) & (x <= W - 1) & (y >= 0) & (y <= H - 1)
+    x0 = np.clip(np.floor(x).astype(int), 0, W - 2)
+    y0 = np.clip(np.floor(y).astype(int), 0, H - 2)
+    fx = np.clip(x - x0, 0, 1)
+    fy = np.clip(y - y0, 0, 1)
+
+    Q11 = depths[frame_idx, y0, x0]
+    Q21 = depths[frame_idx, y0, x0 + 1]
+    Q12 = depths[frame_idx, y0 + 1, x0]
+    Q22 = depths[frame_idx, y0 + 1, x0 + 1]
+    neighbours = np.stack([Q11, Q21, Q12, Q22])
+    valid = inside & np.all(np.isfinite(neighbours) & (neighbours > 0), axis=0)
+
+    d = (Q11 * (1 - fx) * (1 - fy) +
+         Q21 * fx * (1 - fy) +
+         Q12 * (1 - fx) * fy +
+         Q22 * fx * fy)
+    d[~valid] = np.nan
+    return d, valid
+
+
+def sample_marker_depths(depths, keypoints_per_frame):
+    # depths (frames, H, W) and one (markers, 5, 2) keypoint array per frame -> (detections, 5, 3) observations
+    # (p_x, p_y, d) of all detections of all frames and their (detections, 5) validity mask
+    keypoints = np.concatenate(keypoints_per_frame, axis=0)
+    n_markers = [kp.shape[0] for kp in keypoints_per_frame]
+    frame_idx = np.repeat(np.arange(len(keypoints_per_frame)), np.array(n_markers, dtype=int) * N_KEYPOINTS)
+    d, valid = sample_depth(depths, frame_idx, keypoints.reshape(-1, 2))
+    observations = np.concatenate([keypoints, d.reshape(-1, N_KEYPOINTS, 1)], axis=-1)
+    return observations, valid.reshape(-1, N_KEYPOINTS)
@@ -4,6 +4,12 @@
 
 import robotic as ry
 from robotic.src import h5_helper
+import sys
+from pathlib import Path
+
+root = Path(__file__).parent.parent
+sys.path.append(str(root))
+from common.ik_cache import IKCache
 
 C = ry.Config()
 C.addFile(ry.raiPath('scenarios/pandaSingle_camera.g'))
@@ -28,7 +34,9 @@ for line in gt_opti_output.split('\n'):
 C.addFrame('baseframemarker', 'l_panda_base').setShape(ry.ST.marker, [1])
 C.view(True)
 
-def ik_marker(C, marker_name):
+ik_cache = IKCache(root / 'data' / 'ik_cache.json')
+
+def ik_marker_komo(C, marker_name):
     komo = ry.KOMO(C, 1,1,0,True)
 
     komo.addControlObjective([], 0, 1e-1)
@@ -40,9 +48,11 @@ def ik_marker(C, marker_name):
     komo.addObjective([], ry.FS.position, ['l_gripper'], ry.OT.eq, [0,0,1], [0,0,.65])
     komo.addObjective([], ry.FS.scalarProductXZ, ['l_gripper', 'world'], ry.OT.eq)
     komo.addObjective([], ry.FS.scalarProductYZ, ['l_gripper', 'world'], ry.OT.eq)
-    ret = ry.NLP_Solver(komo.nlp(), verbose=-1).solve()
-    print(ret)
-    return komo.getPath()[-1]
+    return komo
+
+def ik_marker(C, marker_name):
+    params = C.getFrame(marker_name).getPosition().tolist()
+    return ik_cache.solve(('ik_marker', marker_name, 'pandaSingle_camera'), params, lambda: ik_marker_komo(C, marker_name))
 
 
 for id in [0,1,4,6,11,12,14]:
@@ -52,4 +62,6 @@ for id in [0,1,4,6,11,12,14]:
         bot.moveTo(goal)
         bot.wait(C)
     C.view(True)
+ik_cache.save()
+print(ik_cache.summary())
 bot.home(C)
\ No newline at end of file
@@ -7,6 +7,11 @@ from robotic.src import h5_helper
 from parse_arucos import parse_arucos
 from pathlib import Path
 import re
+import sys
+
+root = Path(__file__).parent.parent
+sys.path.append(str(root))
+from common.ik_cache import IKCache
 
 USE_JOINTS = True
 Z_HEIGHT = 0.68
@@ -52,7 +57,9 @@ for match in matches:
 
 bot = ry.BotOp(C, True)
 
-def ik_marker(C, marker_name, cost):
+ik_cache = IKCache(root / 'data' / 'ik_cache.json')
+
+def ik_marker_komo(C, marker_name, cost):
     komo = ry.KOMO(C, 1,1,0,True)
 
     komo.addControlObjective([], 0, cost)
@@ -64,9 +71,13 @@ def ik_marker(C, marker_name, cost):
     # komo.addObjective([], ry.FS.position, ['l_gripper'], ry.OT.eq, [0,0,1], [0,0,Z_HEIGHT])
     komo.addObjective([], ry.FS.scalarProductXZ, ['l_gripper', 'world'], ry.OT.eq)
     komo.addObjective([], ry.FS.scalarProductYZ, ['l_gripper', 'world'], ry.OT.eq)
-    ret = ry.NLP_Solver(komo.nlp(), verbose=-1).solve()
-    print(ret)
-    return komo.getPath()[-1]
+    return komo
+
+def ik_marker(C, marker_name, cost):
+    # the calibration changes the marker poses, so it is part of the key
+    params = C.getFrame(marker_name).getPosition().tolist() + [cost]
+    calibration = 'with_joints' if USE_JOINTS else 'wo_joints'
+    return ik_cache.solve(('ik_marker', marker_name, calibration), params, lambda: ik_marker_komo(C, marker_name, cost))
 
 def move_to_next_marker(C, marker_name):
     komo = ry.KOMO(C, 2,10,2,True)
@@ -104,5 +115,7 @@ for id in [0,1,4,6,11,12,14]:
         bot.wait(C)
 
 print("done")
+ik_cache.save()
+print(ik_cache.summary())
 C.view(True)
 bot.home(C)
\ No newline at end of file
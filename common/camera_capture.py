@@ -0,0 +1,128 @@
+# Background camera capture for interactive loops. A thread pulls frames with bot.getImageDepthPcl into a small
+# ring buffer (older frames are simply overwritten), latest returns the newest frame without blocking. Loops can
+# then sync the viewer at its own rate and only process a frame when a new one arrived. next_frame returns a frame
+# whose capture started after the call, e.g. after the arm was stopped and synced, so it matches the joint state.
+# Capture start times come from time.time(), or from bot.clock() for the RecordingBot / ReplayBot of
+# common/recording.py (the recorded time of the thread's last record), so replays pick the same frames as the
+# recorded session.
+# BotOp is not documented to be thread safe, wrap it in SerializedBot when the main thread uses it while the
+# capture thread runs, every call then holds one shared lock. sync only holds it for the sync itself, its waitTime
+# is spent outside, so the viewer syncs at its own rate while frames are captured at camera rate.
+# Usage:
+#   bot = SerializedBot(ry.BotOp(C, True))
+#   camera = CameraCapture(bot, 'l_cameraWrist').start()
+#   while ...:
+#       frame = camera.latest()
+#       if frame is not None and frame.index != last_index: ... process frame.rgb, frame.depth, frame.points
+#   camera.stop()
+
+import threading
+import time
+from collections import namedtuple
+
+
+Frame = namedtuple('Frame', ['rgb', 'depth', 'points', 'timestamp', 'index', 'start'])
+
+BUFFER_SIZE = 2
+MIN_PERIOD = 1/30 # s, the camera does not deliver faster than this, no need to poll more often
+
+
+class SerializedBot:
+    # calls of the wrapped bot from several threads are serialized with one lock, unless it is thread_safe itself
+    def __init__(self, bot):
+        self.bot = bot
+        self.lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.bot, name)
+        if not callable(attribute) or getattr(self.bot, 'thread_safe', False):
+            return attribute
+
+        def serialized(*args, **kwargs):
+            with self.lock:
+                return attribute(*args, **kwargs)
+        return serialized
+
+    def sync(self, C, waitTime=.1, viewMsg=''):
+        # BotOp.sync blocks for waitTime, that wait is done before taking the lock so the capture thread keeps
+        # running. The state is synced after the wait, so frames captured during it are older than the sync.
+        if getattr(self.bot, 'thread_safe', False):
+            return self.bot.sync(C, waitTime=waitTime, viewMsg=viewMsg)
+        time.sleep(waitTime)
+        with self.lock:
+            return self.bot.sync(C, waitTime=0, viewMsg=viewMsg)
+
+
+class CameraCapture:
+    def __init__(self, bot, sensor='l_cameraWrist', buffer_size=BUFFER_SIZE, min_period=MIN_PERIOD):
+        self.bot = bot
+        self.sensor = sensor
+        self.min_period = min_period
+        self.buffer = [None] * buffer_size
+        self.n_frames = 0
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+        self.stopped = threading.Event()
+        self.error = None # exception of the camera, e.g. EOFError at the end of a replayed recording
+        self.clock = getattr(bot, 'clock', None)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            start = time.time()
+            try:
+                rgb, depth, points = self.bot.getImageDepthPcl(self.sensor)
+                captured = self.clock() if self.clock is not None else start
+            except Exception as e:
+                with self.new_frame:
+                    self.error = e
+                    self.new_frame.notify_all()
+                return
+            with self.new_frame:
+                self.buffer[self.n_frames % len(self.buffer)] = Frame(rgb, depth, points, time.time(), self.n_frames,
+                                                                   captured)
+                self.n_frames += 1
+                self.new_frame.notify_all()
+            self.stopped.wait(max(0, self.min_period - (time.time() - start)))
+
+    def latest(self):
+        # newest frame or None if no frame was captured yet, never blocks on the camera
+        with self.lock:
+            if self.n_frames == 0:
+                return None
+            return self.buffer[(self.n_frames - 1) % len(self.buffer)]
+
+    def wait_for_frame(self, after_index=-1, timeout=None):
+        # blocks until a frame newer than after_index is available and returns it (None on timeout), raises the
+        # exception of the camera if it failed before
+        with self.new_frame:
+            if not self.new_frame.wait_for(lambda: self.n_frames - 1 > after_index or self.error is not None, timeout):
+                return None
+            if self.n_frames - 1 <= after_index:
+                raise self.error
+            return self.buffer[(self.n_frames - 1) % len(self.buffer)]
+
+    def next_frame(self, timeout=None):
+        # the first frame whose capture started after this call (None on timeout)
+        after = self.clock() if self.clock is not None else time.time()
+        newer = lambda: [frame for frame in self.buffer if frame is not None and frame.start >= after]
+        with self.new_frame:
+            if not self.new_frame.wait_for(lambda: newer() or self.error is not None, timeout):
+                return None
+            if not newer():
+                raise self.error
+            return min(newer(), key=lambda frame: frame.index)
@@ -0,0 +1,306 @@
+# Single indexed store for all calibration data. One compressed h5 file holds
+#   sessions/<session>/pose_<i>/<name>  per pose arrays (joint state, pointcloud, marker keypoints, ...), read lazily
+#   observations/<column>               one row per 3d observation of a marker: session, pose, repetition, marker_id,
+#                                       calibration, kind (what value means, see KINDS) and value (3,). pose is -1 if
+#                                       not per pose, repetition numbers repeated measurements without a pose (else -1)
+#   index/<column>/{keys,starts,order}  rows sorted by column (INDEXED), so a query only reads the rows it returns
+# session, calibration and kind are stored as codes into the name lists in the attributes of observations.
+# Importers exist for every format used so far: the h5 datasets of the collectors (dataset_[i]/* with a json
+# manifest, automatic and manual ArUco collection), the marker ground truth, the old json pointclouds, the
+# comparison pickle and the old solution's csv.
+# Usage:
+#   python common/dataset_store.py data/calibration_store.h5 data/aruco_calibration_data_v2.h5 data/marker_gt_new.h5
+#   store = DatasetStore('data/calibration_store.h5')
+#   obs = store.observations(marker_id=14, kind='base_position') # dict of columns
+#   pose = store.pose('aruco_calibration_data_v2', 3); pose['joint_state']
+
+import json
+import pickle
+import sys
+import h5py
+import numpy as np
+from pathlib import Path
+
+
+STORE_FILE = Path(__file__).parent.parent / 'data' / 'calibration_store.h5'
+INDEXED = ['marker_id', 'pose', 'session', 'calibration', 'kind'] # a query uses the first index of its conditions
+KINDS = {
+    'center_pixel_depth': 'marker center (p_x, p_y, d), marker_keypoints of the automatic ArUco collection',
+    'corner_pixel_depth': 'first marker corner (p_x, p_y, d), marker_positions of the automatic ArUco collection',
+    'center_pixel': 'marker center (p_x, p_y, nan) without depth, centers of the manual ArUco collection',
+    'ground_truth': 'marker position (x, y, 0) in l_panda_base',
+    'base_position': 'measured marker position in l_panda_base',
+    'camera_position': 'marker position in the camera frame',
+    'gripper_ground_truth': 'ground truth marker position in the gripper frame',
+}
+CATEGORIES = ['session', 'calibration', 'kind'] # stored as codes into name lists
+COLUMNS = {'session': np.int32, 'pose': np.int32, 'repetition': np.int32, 'marker_id': np.int32, 'calibration': np.int32,
+           'kind': np.int32}
+COMPRESSION = dict(chunks=True, compression='gzip', shuffle=True)
+CAMERAS = ['table_calibrated_camera', 'aruco_calibrated_camera_20_poses', 'aruco_calibrated_camera_100_poses',
+           'l_cameraWrist_o'] # order of the results in comparison_results_*.pkl
+
+
+class LazyPose:
+    # arrays of one pose, each is read from the file on first access
+    def __init__(self, group):
+        self.group = group
+        self.cache = dict()
+
+    def keys(self):
+        return list(self.group.keys())
+
+    def __contains__(self, name):
+        return name in self.group
+
+    def __getitem__(self, name):
+        if name not in self.cache:
+            self.cache[name] = self.group[name][()]
+        return self.cache[name]
+
+
+class DatasetStore:
+    def __init__(self, filename=STORE_FILE, mode='a'):
+        self.filename = filename
+        self.fil = h5py.File(filename, mode)
+        self.names = {c: json.loads(self.fil['observations'].attrs[c]) if 'observations' in self.fil else []
+                      for c in CATEGORIES}
+        self.pending = [] # observation rows added since the last flush
+
+    def close(self):
+        self.flush()
+        self.fil.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _code(self, category, name):
+        if name is None:
+            return -1
+        if name not in self.names[category]:
+            self.names[category].append(name)
+        return self.names[category].index(name)
+
+    # sessions and poses
+
+    def add_session(self, session, metadata=None):
+        if f'sessions/{session}' in self.fil:
+            raise ValueError(f"Session {session} already exists")
+        group = self.fil.create_group(f'sessions/{session}')
+        group.attrs['metadata'] = json.dumps(metadata or {})
+        self._code('session', session)
+        return group
+
+    def sessions(self):
+        return list(self.fil['sessions'].keys()) if 'sessions' in self.fil else []
+
+    def metadata(self, session):
+        return json.loads(self.fil[f'sessions/{session}'].attrs['metadata'])
+
+    def add_pose(self, session, i, **arrays):
+        group = self.fil.require_group(f'sessions/{session}/pose_{i}')
+        for name, data in arrays.items():
+            if name in group:
+                del group[name]
+            data = np.asarray(data)
+            # only arrays worth chunking are compressed
+            group.create_dataset(name, data=data, **(COMPRESSION if data.size > 1024 else {}))
+
+    def n_poses(self, session):
+        return len(self.fil[f'sessions/{session}'])
+
+    def pose(self, session, i):
+        return LazyPose(self.fil[f'sessions/{session}/pose_{i}'])
+
+    def poses(self, session):
+        # yields the poses of a session in order, nothing is read until an array is accessed
+        for i in range(self.n_poses(session)):
+            yield self.pose(session, i)
+
+    # observations
+
+    def add_observations(self, session, pose, marker_ids, values, kind, calibration=None, repetition=-1):
+        values = np.asarray(values, dtype=np.float32).reshape(-1, 3)
+        n = values.shape[0]
+        self.pending.append({
+            'session': np.full(n, self._code('session', session)),
+            'pose': np.broadcast_to(pose, n),
+            'repetition': np.broadcast_to(repetition, n),
+            'marker_id': np.broadcast_to(marker_ids, n),
+            'calibration': np.full(n, self._code('calibration', calibration)),
+            'kind': np.full(n, self._code('kind', kind)),
+            'value': values
+        })
+
+    def flush(self):
+        # appends the pending rows and rebuilds the indices
+        if not self.pending:
+            return
+        columns = {name: np.concatenate([rows[name] for rows in self.pending]) for name in list(COLUMNS) + ['value']}
+        if 'observations' in self.fil:
+            columns = {name: np.concatenate([self._column(self.fil['observations'], name), data])
+                       for name, data in columns.items()}
+            del self.fil['observations']
+        self.pending = []
+
+        group = self.fil.create_group('observations')
+        for name, dtype in COLUMNS.items():
+            group.create_dataset(name, data=columns[name].astype(dtype), **COMPRESSION)
+        group.create_dataset('value', data=columns['value'], **COMPRESSION)
+        for c in CATEGORIES:
+            group.attrs[c] = json.dumps(self.names[c])
+
+        if 'index' in self.fil:
+            del self.fil['index']
+        for name in INDEXED:
+            order = np.argsort(columns[name], kind='stable')
+            keys, starts = np.unique(columns[name][order], return_index=True)
+            index = self.fil.create_group(f'index/{name}')
+            index.create_dataset('keys', data=keys)
+            index.create_dataset('starts', data=np.append(starts, order.shape[0]))
+            index.create_dataset('order', data=order, **COMPRESSION)
+
+    def _column(self, group, name, rows=None):
+        # rows of a column (all if None), columns added after a store was written read as -1
+        if name not in group:
+            n = group['value'].shape[0] if rows is None else rows.shape[0]
+            return np.full(n, -1, dtype=COLUMNS[name])
+        if rows is None:
+            return group[name][()]
+        # h5py can't select an empty list of rows
+        return group[name][rows] if rows.shape[0] > 0 else group[name][:0]
+
+    def _rows(self, name, key):
+        # row numbers with column name == key from the index, in file order
+        index = self.fil[f'index/{name}']
+        keys = index['keys'][()]
+        j = np.searchsorted(keys, key)
+        if j == keys.shape[0] or keys[j] != key:
+            return np.zeros(0, dtype=np.int64)
+        starts = index['starts']
+        return np.sort(index['order'][starts[j]:starts[j + 1]])
+
+    def observations(self, marker_id=None, session=None, calibration=None, kind=None, pose=None, repetition=None):
+        # rows matching all given conditions as a dict of columns (categories decoded to names). Only the index of
+        # the first given indexed condition and the selected rows are read.
+        self.flush()
+        if 'observations' not in self.fil:
+            return {name: np.zeros(0) for name in list(COLUMNS) + ['value']}
+        query = {'marker_id': marker_id, 'session': session, 'calibration': calibration, 'kind': kind}
+        query = {name: (self.names[name].index(key) if key in self.names[name] else -2) if name in CATEGORIES else key
+                 for name, key in query.items() if key is not None}
+
+        group = self.fil['observations']
+        if pose is not None:
+            query['pose'] = pose
+        indexed = [name for name in INDEXED if name in query and f'index/{name}' in self.fil] # older stores lack some
+        if indexed:
+            rows = self._rows(indexed[0], query.pop(indexed[0]))
+            columns = {name: self._column(group, name, rows) for name in list(COLUMNS) + ['value']}
+        else:
+            columns = {name: self._column(group, name) for name in list(COLUMNS) + ['value']}
+        if repetition is not None:
+            query['repetition'] = repetition
+
+        mask = np.ones(columns['value'].shape[0], dtype=bool)
+        for name, key in query.items():
+            mask &= columns[name] == key
+        columns = {name: data[mask] for name, data in columns.items()}
+        for c in CATEGORIES:
+            names = np.array(self.names[c] + [None], dtype=object) # code -1 maps to None
+            columns[c] = names[columns[c]]
+        return columns
+
+
+# importers
+
+def import_h5_datasets(store, filename, session=None):
+    # files written with h5_helper: a json manifest and dataset_[i]/* groups (table and ArUco collectors). All arrays
+    # are copied per pose, the marker centers and first corners are added as observations of their kind.
+    session = session or Path(filename).stem
+    with h5py.File(filename, 'r') as f:
+        manifest = json.loads(bytes(f['manifest'][()].astype(np.uint8)).decode('utf-8'))
+        store.add_session(session, {'source': str(filename), 'manifest': manifest})
+        n = 0
+        for i in range(manifest['n_datasets']):
+            key = f'dataset_{i}'
+            if key not in f:
+                continue
+            arrays = {name: f[key][name][()] for name in f[key]}
+            store.add_pose(session, n, **arrays)
+            if 'marker_ids' in arrays:
+                if 'marker_keypoints' in arrays:
+                    store.add_observations(session, n, arrays['marker_ids'], arrays['marker_keypoints'][:, -1],
+                                           'center_pixel_depth')
+                if 'marker_positions' in arrays:
+                    store.add_observations(session, n, arrays['marker_ids'], arrays['marker_positions'],
+                                           'corner_pixel_depth')
+            elif 'ids' in arrays:
+                # manual ArUco collection, pixel centers without depth
+                centers = np.asarray(arrays['centers'], dtype=np.float32).reshape(-1, 2)
+                store.add_observations(session, n, arrays['ids'].ravel(),
+                                       np.column_stack([centers, np.full(centers.shape[0], np.nan)]), 'center_pixel')
+            n += 1
+        # marker ground truth files have marker_[id]/position groups (x, y in l_panda_base) instead of datasets
+        for id in manifest.get('marker_ids', []):
+            if f'marker_{id}/position' in f:
+                position = f[f'marker_{id}/position'][()]
+                store.add_observations(session, -1, id, np.append(position, [0] * (3 - position.shape[0])),
+                                       'ground_truth')
+    return session
+
+
+def import_json_pointclouds(store, filename, session=None):
+    # the old table calibration json: list of dicts with id, gripper_pose, joint_state and pointcloud
+    session = session or Path(filename).stem
+    with open(filename, 'r') as f:
+        data = json.load(f)
+    store.add_session(session, {'source': str(filename)})
+    for i, entry in enumerate(data):
+        store.add_pose(session, i, joint_state=entry['joint_state'], gripper_pose=entry['gripper_pose'],
+                       pointcloud=np.asarray(entry['pointcloud'], dtype=np.float32).reshape(-1, 3))
+    return session
+
+
+def import_comparison_pickle(store, filename, session=None, calibrations=CAMERAS):
+    # compare_calibrations_measurement.py results: one dict marker id -> list of base positions per calibration.
+    # The same measurement is evaluated with every calibration, so the k-th entry of a marker is repetition k of
+    # that marker with every calibration. The poses of the measurements were not stored (-1).
+    session = session or Path(filename).stem
+    with open(filename, 'rb') as f:
+        results = pickle.load(f)
+    store.add_session(session, {'source': str(filename), 'calibrations': list(calibrations)})
+    for calibration, result in zip(calibrations, results):
+        for id, positions in result.items():
+            for k, position in enumerate(positions):
+                store.add_observations(session, -1, id, position, 'base_position', calibration, repetition=k)
+    return session
+
+
+def import_csv(store, filename, session=None):
+    # old solution/calibration_data.csv: marker position in the camera frame and ground truth in the gripper frame
+    # per row. Neither the marker ids nor the pose of a row were recorded, so both are -1. The observations of the
+    # two kinds pair up by their order, the k-th of each kind is row k.
+    session = session or Path(filename).stem
+    data = np.loadtxt(filename, delimiter=',', skiprows=1, ndmin=2)
+    store.add_session(session, {'source': str(filename), 'rows': data.shape[0]})
+    store.add_observations(session, -1, -1, data[:, :3], 'camera_position')
+    store.add_observations(session, -1, -1, data[:, 3:], 'gripper_ground_truth')
+    return session
+
+
+IMPORTERS = {'.h5': import_h5_datasets, '.json': import_json_pointclouds, '.pkl': import_comparison_pickle,
+             '.csv': import_csv}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('usage: python dataset_store.py store.h5 file [file ...]')
+        sys.exit(1)
+    with DatasetStore(sys.argv[1]) as store:
+        for filename in sys.argv[2:]:
+            session = IMPORTERS[Path(filename).suffix](store, filename)
+            print(f'imported {filename} as session {session}')
@@ -0,0 +1,63 @@
+# Temporal fusion of the pointclouds of a stationary camera. The organized (H, W, 3) clouds of K frames are copied
+# into a preallocated ring buffer, invalid pixels (nan or zero depth) are marked as nan. fuse returns the per pixel
+# median (or mean) cloud, the per pixel variance of the depth and the number of frames each pixel was valid in.
+# Pixels valid in less than min_valid of the frames are nan in the fused cloud.
+# Usage:
+#   fusion = DepthFusion(K)
+#   for _ in range(K): fusion.add(bot.getImageDepthPcl('l_cameraWrist')[2])
+#   points, variance, n_valid = fusion.fuse()
+
+import numpy as np
+
+
+METHOD = 'median' # or 'mean'
+MIN_VALID = 0.5 # fraction of the frames a pixel has to be valid in
+
+
+class DepthFusion:
+    def __init__(self, n_frames, method=METHOD, min_valid=MIN_VALID):
+        self.n_frames = n_frames
+        self.method = method
+        self.min_valid = min_valid
+        self.buffer = None # (K, H, W, 3) float32, allocated for the first frame
+        self.count = 0
+
+    def reset(self):
+        self.count = 0
+
+    def add(self, points):
+        points = np.asarray(points)
+        if self.buffer is None or self.buffer.shape[1:] != points.shape:
+            self.buffer = np.empty((self.n_frames,) + points.shape, dtype=np.float32)
+            self.count = 0
+        frame = self.buffer[self.count % self.n_frames]
+        frame[...] = points
+        frame[frame[..., 2] == 0] = np.nan
+        self.count += 1
+
+    def fuse(self):
+        # (H, W, 3) fused cloud, (H, W) depth variance and (H, W) number of valid frames
+        frames = self.buffer[:min(self.count, self.n_frames)]
+        valid = np.isfinite(frames[..., 2])
+        n_valid = valid.sum(axis=0)
+        enough = n_valid >= max(1, self.min_valid * frames.shape[0])
+        frames = frames[:, enough]
+        n = n_valid[enough]
+        if self.method == 'median':
+            # nan sorts last, so the median of the valid values sits at (n - 1) // 2 and n // 2
+            ordered = np.sort(frames, axis=0)
+            lower = np.take_along_axis(ordered, ((n - 1) // 2)[None, :, None].repeat(3, axis=2), axis=0)[0]
+            upper = np.take_along_axis(ordered, (n // 2)[None, :, None].repeat(3, axis=2), axis=0)[0]
+            fused = (lower + upper) / 2
+        elif self.method == 'mean':
+            fused = np.nansum(frames, axis=0) / n[:, None]
+        else:
+            raise ValueError("Invalid method option")
+        depth = np.nan_to_num(frames[..., 2] - np.nanmean(frames[..., 2], axis=0))
+        variance = np.einsum('ki,ki->i', depth, depth) / n
+
+        points = np.full(self.buffer.shape[1:], np.nan, dtype=np.float32)
+        points[enough] = fused
+        depth_variance = np.full(self.buffer.shape[1:3], np.nan, dtype=np.float32)
+        depth_variance[enough] = variance
+        return points, depth_variance, n_valid
@@ -0,0 +1,105 @@
+# Persistent cache of IK/KOMO solutions. Entries are grouped by a discrete key (objective type, target frame,
+# calibration) and store the continuous parameters of the problem (target position, distance, angle, ...) with
+# the solution. A query with parameters within TOLERANCE of a stored entry returns the stored solution directly,
+# otherwise the solution of the closest entry (if within MAX_SEED_DISTANCE) is used to initialize the solver.
+# Parameters of different units (m, rad, ...) are divided by a per dimension scale before their distance is taken,
+# so TOLERANCE and MAX_SEED_DISTANCE are in units of the scale (m without one). lookup counts the hits, near misses
+# (seeded) and misses for summary. A seeded solution depends on what the cache already holds, callers that need
+# reproducible solutions pass seed=False and only take exact hits.
+# Problems that constrain l_cameraWrist depend on its calibrated pose in the g-file, their keys include
+# camera_calibration(C) so a new cameraWrist Q does not return joint states solved for the old one.
+# The cache is stored as json, so repeated sessions skip most of the solver time.
+# Usage:
+#   cache = IKCache(root / 'data' / 'ik_cache.json')
+#   q = cache.solve(('look_at_marker', marker_name, camera_calibration(C)), params, lambda: build_komo(...))
+#   q, seed = cache.lookup(key, position + [distance, angle], scale=[1, 1, 1, 1, ANGLE_SCALE])
+#   cache.save()
+
+import hashlib
+import json
+import os
+import numpy as np
+import robotic as ry
+
+
+TOLERANCE = 1e-6
+MAX_SEED_DISTANCE = 0.2
+CAMERA_FRAME = 'l_cameraWrist'
+
+
+def camera_calibration(C, frame=CAMERA_FRAME):
+    # short hash of the camera pose relative to its parent, part of the key of problems constraining the camera
+    return hashlib.sha1(np.round(C.getFrame(frame).getRelativePose(), 8).tobytes()).hexdigest()[:12]
+
+
+class IKCache:
+    def __init__(self, filename=None, tolerance=TOLERANCE, max_seed_distance=MAX_SEED_DISTANCE):
+        self.filename = filename
+        self.tolerance = tolerance
+        self.max_seed_distance = max_seed_distance
+        self.entries = dict() # key -> (params (n, p), solutions (n, q))
+        self.hits = 0
+        self.seeded = 0
+        self.misses = 0
+        if filename is not None and os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                for key, (params, solutions) in json.load(f).items():
+                    self.entries[key] = (np.array(params), np.array(solutions))
+
+    def _key(self, key):
+        return '/'.join(str(k) for k in key)
+
+    def lookup(self, key, params, scale=None, seed=True):
+        # returns (solution, None) on a hit, (None, seed) on a near miss and (None, None) otherwise. scale is one
+        # divisor per parameter (None for 1), without seed near misses are misses.
+        key = self._key(key)
+        if key not in self.entries:
+            self.misses += 1
+            return None, None
+        stored_params, solutions = self.entries[key]
+        scale = np.ones(stored_params.shape[1]) if scale is None else np.asarray(scale, dtype=float)
+        distances = np.linalg.norm((stored_params - np.asarray(params, dtype=float)) / scale, axis=-1)
+        closest = np.argmin(distances)
+        if distances[closest] <= self.tolerance:
+            self.hits += 1
+            return solutions[closest].copy(), None
+        if seed and distances[closest] <= self.max_seed_distance:
+            self.seeded += 1
+            return None, solutions[closest].copy()
+        self.misses += 1
+        return None, None
+
+    def store(self, key, params, solution):
+        key = self._key(key)
+        params = np.asarray(params, dtype=float)[None, :]
+        solution = np.asarray(solution, dtype=float)[None, :]
+        if key in self.entries:
+            stored_params, solutions = self.entries[key]
+            params = np.vstack([stored_params, params])
+            solution = np.vstack([solutions, solution])
+        self.entries[key] = (params, solution)
+
+    def solve(self, key, params, build_komo, scale=None):
+        # build_komo returns the KOMO problem, it is only called if the cache has no exact hit
+        q, seed = self.lookup(key, params, scale)
+        if q is not None:
+            return q
+        komo = build_komo()
+        if seed is not None:
+            komo.initWithConstant(seed)
+        ret = ry.NLP_Solver(komo.nlp(), verbose=-1).solve()
+        print(ret)
+        q = komo.getPath()[-1]
+        if ret.feasible:
+            self.store(key, params, q)
+        return q
+
+    def save(self):
+        if self.filename is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        with open(self.filename, 'w') as f:
+            json.dump({key: (params.tolist(), solutions.tolist()) for key, (params, solutions) in self.entries.items()}, f)
+
+    def summary(self):
+        return f'ik cache: {self.hits} hits, {self.seeded} seeded, {self.misses} misses'
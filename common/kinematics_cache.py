@@ -0,0 +1,84 @@
+# Forward kinematics of recorded joint states, computed once per dataset. For every joint state the world
+# transforms of FRAMES are stacked into one (N, F, 4, 4) array and stored next to the dataset as <dataset>.fk.npz,
+# keyed by a hash of the joint states, the g-file and the frame names. Consumers then get all transforms of a frame
+# (or relative to another frame) as (N, 4, 4) arrays without setting joint states or evaluating features again.
+# Usage:
+#   fk = KinematicsCache(C, joint_states, cache_file(DATA_FILE))
+#   T = fk.relative('l_cameraWrist', to='l_panda_base') # (N, 4, 4)
+
+import hashlib
+import numpy as np
+import robotic as ry
+from pathlib import Path
+
+
+G_FILE = 'scenarios/pandaSingle_camera.g'
+FRAMES = ['l_panda_base', 'l_gripper', 'l_panda_joint7', 'l_cameraWrist', 'origin']
+
+
+def invert_transforms(T):
+    # inverse of stacked homogeneous transforms (..., 4, 4)
+    T_inv = np.zeros_like(T)
+    R_inv = np.swapaxes(T[..., :3, :3], -1, -2)
+    T_inv[..., :3, :3] = R_inv
+    T_inv[..., :3, 3] = -np.einsum('...ij,...j->...i', R_inv, T[..., :3, 3])
+    T_inv[..., 3, 3] = 1
+    return T_inv
+
+
+def frame_transforms(C, frames):
+    # world transforms of frames in the current joint state, (F, 4, 4)
+    return np.stack([C.getFrame(frame).getTransform() for frame in frames])
+
+
+def compute_transforms(C, joint_states, frames=FRAMES):
+    # (N, F, 4, 4), one setJointState per joint state, C is left in its original joint state
+    q0 = C.getJointState()
+    transforms = np.empty((len(joint_states), len(frames), 4, 4))
+    for i, q in enumerate(joint_states):
+        C.setJointState(q)
+        transforms[i] = frame_transforms(C, frames)
+    C.setJointState(q0)
+    return transforms
+
+
+def cache_key(joint_states, g_file=G_FILE, frames=FRAMES):
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(joint_states, dtype=np.float64).tobytes())
+    h.update(Path(ry.raiPath(g_file)).read_bytes())
+    h.update(','.join(frames).encode())
+    return h.hexdigest()
+
+
+def cache_file(dataset_file):
+    return Path(dataset_file).with_suffix('.fk.npz')
+
+
+class KinematicsCache:
+    # C must be loaded from g_file, it is only used if the cache file is missing or outdated
+    def __init__(self, C, joint_states, filename=None, g_file=G_FILE, frames=FRAMES):
+        self.frames = list(frames)
+        self.filename = filename
+        self.hit = False
+        joint_states = np.asarray(joint_states, dtype=np.float64)
+        key = cache_key(joint_states, g_file, self.frames)
+        if filename is not None and Path(filename).is_file():
+            with np.load(filename) as data:
+                if str(data['key']) == key:
+                    self.transforms = data['transforms']
+                    self.hit = True
+        if not self.hit:
+            self.transforms = compute_transforms(C, joint_states, self.frames)
+            if filename is not None:
+                np.savez(filename, key=key, transforms=self.transforms)
+
+    def __len__(self):
+        return self.transforms.shape[0]
+
+    def get(self, frame):
+        # world transforms of frame for all joint states, (N, 4, 4)
+        return self.transforms[:, self.frames.index(frame)]
+
+    def relative(self, frame, to):
+        # transforms of frame expressed in the frame to, (N, 4, 4)
+        return invert_transforms(self.get(to)) @ self.get(frame)
@@ -0,0 +1,125 @@
+# Shared pointcloud preprocessing for the collectors and measurement scripts: range filtering on squared distances
+# (one pass, no sqrt), removal of invalid points (nan or zero depth) and decimation to a point budget, either by
+# taking every k-th point or by keeping one averaged point per voxel. Outputs are float32 (n, 3) arrays, colors (or
+# any other per point values, returned as (n, c)) are filtered along with the points if given.
+# Usage:
+#   points, rgb = preprocess(points, MIN_DISTANCE, MAX_DISTANCE, colors=rgb, max_points=50_000)
+# Run this file for a benchmark on a synthetic frame.
+
+import time
+import numpy as np
+
+
+def squared_distances(points):
+    return np.einsum('ij,ij->i', points, points)
+
+
+def range_mask(points, min_distance, max_distance):
+    # min_distance < |p| < max_distance, points with nan coordinates fail both comparisons and are dropped,
+    # as are zero depth points (which sit at the camera origin) for any min_distance > 0
+    d2 = squared_distances(points)
+    return (d2 > min_distance**2) & (d2 < max_distance**2)
+
+
+def valid_mask(points):
+    # finite points with nonzero depth, for the cases without a range filter
+    return np.isfinite(points).all(axis=-1) & (points[..., 2] != 0)
+
+
+def filter_points(points, min_distance=None, max_distance=None, colors=None):
+    # flattens an (H, W, 3) or (n, 3) cloud and keeps the valid points within range, as float32
+    points = np.asarray(points).reshape(-1, 3)
+    if min_distance:
+        mask = range_mask(points, min_distance, np.inf if max_distance is None else max_distance)
+    else:
+        mask = valid_mask(points)
+        if max_distance is not None:
+            mask &= range_mask(points, 0, max_distance)
+    points = points[mask].astype(np.float32, copy=False)
+    if colors is None:
+        return points
+    return points, np.asarray(colors).reshape(mask.shape[0], -1)[mask]
+
+
+def stride_decimate(points, max_points, colors=None):
+    # every k-th point, with the smallest k that meets the budget
+    stride = max(1, -(-points.shape[0] // max_points))
+    if colors is None:
+        return points[::stride]
+    return points[::stride], colors[::stride]
+
+
+def voxel_keys(points, voxel_size):
+    # one int64 key per point, the voxel indices relative to the minimum are packed into 21 bits each
+    idx = ((points - points.min(axis=0)) * np.float32(1 / voxel_size)).astype(np.int64)
+    return (idx[:, 0] << 42) | (idx[:, 1] << 21) | idx[:, 2]
+
+
+def voxel_decimate(points, voxel_size=None, max_points=None, colors=None):
+    # Replaces the points of every voxel by their mean (colors by those of the first point). With max_points and no
+    # voxel_size, the voxel size starts at the one that would give max_points voxels for a uniformly filled surface
+    # of the cloud's bounding box and grows until the budget is met.
+    if points.shape[0] == 0 or (voxel_size is None and (max_points is None or points.shape[0] <= max_points)):
+        return points if colors is None else (points, colors)
+    if voxel_size is None:
+        extent = np.sort(points.max(axis=0) - points.min(axis=0))[1:] # the cloud is roughly a surface
+        voxel_size = max(np.sqrt(np.prod(extent) / max_points), 1e-6)
+    while True:
+        keys = voxel_keys(points, voxel_size)
+        order = np.argsort(keys)
+        keys = keys[order]
+        starts = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1])
+        if max_points is None or starts.shape[0] <= max_points:
+            break
+        # the number of occupied voxels of a surface scales with 1 / voxel_size^2
+        voxel_size *= max(np.sqrt(starts.shape[0] / max_points), 1.05)
+    counts = np.diff(np.append(starts, keys.shape[0]))
+    reduced = (np.add.reduceat(points[order], starts, axis=0, dtype=np.float64) / counts[:, None]).astype(np.float32)
+    if colors is None:
+        return reduced
+    return reduced, colors[order[starts]]
+
+
+def preprocess(points, min_distance=None, max_distance=None, colors=None, max_points=None, method='stride',
+               voxel_size=None):
+    # filter_points followed by the decimation method ('stride' or 'voxel') if max_points or voxel_size is given
+    result = filter_points(points, min_distance, max_distance, colors)
+    points, colors = result if colors is not None else (result, None)
+    if method == 'stride' and max_points is not None and points.shape[0] > max_points:
+        result = stride_decimate(points, max_points, colors)
+    elif method == 'voxel' and (max_points is not None or voxel_size is not None):
+        result = voxel_decimate(points, voxel_size, max_points, colors)
+    elif method not in ['stride', 'voxel']:
+        raise ValueError("Invalid method option")
+    return result
+
+
+def benchmark(points, colors, min_distance=0.2, max_distance=0.8, max_points=50_000, repeats=20):
+    def run(name, f):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = f()
+        n = (result[0] if isinstance(result, tuple) else result).shape[0]
+        print(f'{name:24s} {(time.perf_counter() - start) / repeats * 1e3:7.2f}ms/frame, {n:7d} points')
+
+    flat = points.reshape(-1, 3)
+    run('norm mask (old)', lambda: flat[(np.linalg.norm(flat, axis=-1) > min_distance) &
+                                        (np.linalg.norm(flat, axis=-1) < max_distance)])
+    run('range filter', lambda: filter_points(points, min_distance, max_distance))
+    run('range filter + colors', lambda: filter_points(points, min_distance, max_distance, colors))
+    run('stride decimation', lambda: preprocess(points, min_distance, max_distance, max_points=max_points))
+    run('voxel decimation', lambda: preprocess(points, min_distance, max_distance, max_points=max_points,
+                                               method='voxel'))
+
+
+if __name__ == '__main__':
+    # synthetic 640x360 frame of a tilted table with depth holes
+    rng = np.random.default_rng(0)
+    H, W = 360, 640
+    u, v = np.meshgrid(np.arange(W), np.arange(H))
+    d = 0.5 + 0.2 * v / H + rng.normal(0, 0.002, (H, W))
+    d[rng.random((H, W)) < 0.05] = 0
+    points = np.stack([d * (u - W / 2) / 320, -d * (v - H / 2) / 320, -d], axis=-1)
+    points[rng.random((H, W)) < 0.01] = np.nan
+    colors = rng.integers(0, 256, (H, W, 3), dtype=np.uint8)
+    benchmark(points, colors)
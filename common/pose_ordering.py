@@ -0,0 +1,69 @@
+# Orders a set of planned joint configurations to reduce the time the robot spends moving between them.
+# The cost of a move is estimated as the time the slowest joint needs at its maximal velocity, which is
+# roughly how long a point to point motion takes. We build a tour starting at the current configuration
+# with nearest neighbour and improve it with 2-opt until no reversal of a segment shortens it.
+
+import itertools
+import numpy as np
+
+
+MAX_JOINT_VELOCITY = 1. # rad/s, scalar or per joint, only scales the estimated times, not the ordering
+
+
+def travel_time(q0, q1, max_velocity=MAX_JOINT_VELOCITY):
+    return np.max(np.abs(np.asarray(q1) - np.asarray(q0)) / max_velocity)
+
+
+def travel_time_matrix(qs, max_velocity=MAX_JOINT_VELOCITY):
+    qs = np.asarray(qs)
+    return np.max(np.abs(qs[:, None, :] - qs[None, :, :]) / max_velocity, axis=-1)
+
+
+def path_time(D, path):
+    return D[path[:-1], path[1:]].sum()
+
+
+def nearest_neighbour(D):
+    # open path starting at node 0
+    path = [0]
+    visited = np.zeros(D.shape[0], dtype=bool)
+    visited[0] = True
+    for _ in range(D.shape[0] - 1):
+        distances = np.where(visited, np.inf, D[path[-1]])
+        path.append(int(np.argmin(distances)))
+        visited[path[-1]] = True
+    return np.array(path)
+
+
+def two_opt(D, path):
+    # reverses path[i:j+1] whenever that shortens the path, the start node stays fixed
+    path = path.copy()
+    n = len(path)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            j = np.arange(i + 1, n)
+            before = D[path[i - 1], path[i]] + np.append(D[path[j[:-1]], path[j[:-1] + 1]], 0)
+            after = D[path[i - 1], path[j]] + np.append(D[path[i], path[j[:-1] + 1]], 0)
+            gain = before - after
+            best = np.argmax(gain)
+            if gain[best] > 1e-9:
+                path[i:j[best] + 1] = path[i:j[best] + 1][::-1]
+                improved = True
+    return path
+
+
+def order_poses(q_start, qs, max_velocity=MAX_JOINT_VELOCITY):
+    # returns the visiting order of qs and the estimated total motion time before and after ordering
+    D = travel_time_matrix(np.vstack([q_start, qs]), max_velocity)
+    path = two_opt(D, nearest_neighbour(D))
+    return path[1:] - 1, path_time(D, np.arange(D.shape[0])), path_time(D, path)
+
+
+def plan_ordered(planner, n_poses, q_start, max_velocity=MAX_JOINT_VELOCITY):
+    # takes the next n_poses feasible poses of a PosePlanner and returns them as a list in travel optimized order
+    poses = list(itertools.islice(planner, n_poses))
+    order, time_before, time_after = order_poses(q_start, [q for q, _ in poses], max_velocity)
+    print(f'ordered {len(poses)} poses, estimated motion time {time_before:.1f}s -> {time_after:.1f}s')
+    return [poses[k] for k in order]
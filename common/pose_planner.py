@@ -0,0 +1,151 @@
+# Plans camera poses for the automatic data collection in a pool of worker processes, so the robot does not sit
+# idle while KOMO problems are solved (and infeasible ones rejected). Every worker holds its own ry.Config, the main
+# process only samples the targets from its seeded rng and receives the solutions in the same order the samples
+# were drawn, so the sequence of poses is deterministic under SEED independent of the number of workers.
+# If a ReachabilityMap is given, samples in cells known to be infeasible are redrawn before any KOMO problem is built,
+# after MAX_REJECTED rejections in a row the sampler is assumed to only produce unreachable targets.
+# If an IKCache is given, exact hits are not solved again. As the workers always start from the home state, a hit
+# equals the solution a worker would find, so the poses stay deterministic under SEED. Near misses are only
+# initialized from the closest cached solution with seed_from_cache, which makes them depend on the cache contents.
+# Usage:
+#   with PosePlanner(lambda: (target_position, distance, angle)) as planner:
+#       for q, sample in planner:
+#           bot.moveTo(q)
+
+import multiprocessing as mp
+import os
+from collections import deque
+import numpy as np
+import robotic as ry
+from common.ik_cache import camera_calibration
+
+
+SCENARIO = "scenarios/pandaSingle_camera.g"
+MAX_REJECTED = 10_000 # consecutive samples rejected by the reachability map before giving up
+CACHE_SCALE = [1, 1, 1, 1, np.radians(10) / .2] # cache distances in m, 10 deg of angle count as 20 cm
+
+
+def look_with_angle(C, target_name, distance, angle):
+    komo = ry.KOMO(C, 1, 1, 0, True)
+    
+    komo.addControlObjective([], 0, 1e-1)
+
+    height = distance * np.cos(angle)
+
+    komo.addObjective([], ry.FS.accumulatedCollisions, [], ry.OT.eq, [1])
+    komo.addObjective([], ry.FS.negDistance, ['l_cameraWrist', target_name], ry.OT.eq, [1], [-distance]) 
+    komo.addObjective([], ry.FS.jointLimits, [], ry.OT.ineq)
+
+    komo.addObjective([], ry.FS.positionDiff, ['l_cameraWrist', target_name], ry.OT.eq, [0,0,1], [0,0,height])
+    # point camera at target
+    komo.addObjective([], ry.FS.positionRel, [target_name, 'l_cameraWrist'], ry.OT.eq, [[1,0,0],[0,1,0]])
+
+    return komo
+
+
+_worker_config = None
+
+
+def _init_worker(scenario):
+    global _worker_config
+    _worker_config = ry.Config()
+    _worker_config.addFile(ry.raiPath(scenario))
+    _worker_config.addFrame('target')
+
+
+def _solve(sample, seed=None):
+    # the worker config always stays in its home state, so the result only depends on the sample (and seed)
+    target_position, distance, angle = sample
+    _worker_config.getFrame('target').setPosition(target_position)
+    komo = look_with_angle(_worker_config, 'target', distance, angle)
+    if seed is not None:
+        komo.initWithConstant(seed)
+    ret = ry.NLP_Solver(komo.nlp(), verbose=-1).solve()
+    return ret.feasible, komo.getPath()[-1]
+
+
+class _CachedResult:
+    def __init__(self, q):
+        self.q = q
+
+    def get(self):
+        return True, self.q
+
+
+class PosePlanner:
+    def __init__(self, sampler, n_workers=None, lookahead=None, scenario=SCENARIO, cache=None, reachability=None,
+                 seed_from_cache=False):
+        # sampler is called in the main process and returns (target_position, distance, angle)
+        self.sampler = sampler
+        self.scenario = scenario
+        self.cache = cache
+        self.seed_from_cache = seed_from_cache
+        self.reachability = reachability
+        self.n_workers = n_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.lookahead = lookahead or 2 * self.n_workers
+        # spawn instead of fork, the main process already runs the BotOp threads
+        config = ry.Config()
+        config.addFile(ry.raiPath(scenario))
+        self.calibration = camera_calibration(config) # the workers load the same scenario
+        self.pool = mp.get_context('spawn').Pool(self.n_workers, initializer=_init_worker, initargs=(scenario,))
+        self.pending = deque()
+        self.n_rejected = 0
+        self.n_solved = 0
+        self.n_feasible = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def _cache_key(self):
+        return ('look_with_angle', 'target', self.scenario, self.calibration)
+
+    def _cache_params(self, sample):
+        target_position, distance, angle = sample
+        return list(target_position) + [distance, angle]
+
+    def _fill(self):
+        rejected = 0
+        while len(self.pending) < self.lookahead:
+            sample = self.sampler()
+            if self.reachability is not None and not self.reachability.is_feasible(*sample):
+                self.n_rejected += 1
+                rejected += 1
+                if rejected >= MAX_REJECTED:
+                    raise ValueError(f"{rejected} samples in a row were rejected by the reachability map, "
+                                     "the sampled targets seem to be unreachable")
+                continue
+            rejected = 0
+            seed = None
+            if self.cache is not None:
+                q, seed = self.cache.lookup(self._cache_key(), self._cache_params(sample), CACHE_SCALE,
+                                            self.seed_from_cache)
+                if q is not None:
+                    self.pending.append((sample, _CachedResult(q), False))
+                    continue
+            # seeded solutions are not stored, so a later hit always equals an unseeded solve
+            self.pending.append((sample, self.pool.apply_async(_solve, (sample, seed)), seed is None))
+
+    def summary(self):
+        n_sampled = self.n_rejected + self.n_solved
+        return (f'{self.n_feasible} of {n_sampled} sampled poses were feasible '
+                f'({self.n_rejected} rejected by the reachability map, {self.n_feasible} of {self.n_solved} solved ones feasible)')
+
+    def __iter__(self):
+        # yields feasible (q, sample) pairs in sampling order, the next ones are solved in the background meanwhile
+        while True:
+            self._fill()
+            sample, result, store = self.pending.popleft()
+            feasible, q = result.get()
+            self.n_solved += 1
+            if feasible:
+                self.n_feasible += 1
+                if self.cache is not None and store:
+                    self.cache.store(self._cache_key(), self._cache_params(sample), q)
+                yield q, sample
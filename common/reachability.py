@@ -0,0 +1,83 @@
+# Offline reachability table for look_with_angle targets of l_cameraWrist in pandaSingle_camera.g.
+# The space of (target x, target y, distance, angle) for targets at a fixed height is discretized into a grid,
+# look_with_angle is solved once for the center of every cell and the feasibility is stored as a bit array.
+# Each cell is classified from that single KOMO solve at its center: a cell whose center is infeasible is rejected
+# as a whole even if parts of it are reachable (and vice versa), so the map is only as fine as SHAPE.
+# Samplers can then reject targets in infeasible cells with an O(1) lookup before building any KOMO problem.
+# Queries outside of the grid (or at a different target height) are unknown and reported as feasible, so the
+# map never removes samples it knows nothing about. Build with: python common/reachability.py [output.npz]
+
+import sys
+import time
+from pathlib import Path
+import numpy as np
+
+
+LOWER = (-.7, -.3, .2, 0.) # x, y, distance, angle
+UPPER = (.7, .7, .7, 1/2 * np.pi)
+SHAPE = (28, 20, 10, 10)
+TARGET_HEIGHT = .6
+HEIGHT_TOLERANCE = .02
+MAP_FILE = Path(__file__).parent.parent / 'data' / 'reachability_map.npz'
+
+
+class ReachabilityMap:
+    def __init__(self, feasible, lower=LOWER, upper=UPPER, target_height=TARGET_HEIGHT):
+        self.feasible = np.asarray(feasible, dtype=bool)
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.cell_size = (self.upper - self.lower) / self.feasible.shape
+        self.target_height = target_height
+
+    @staticmethod
+    def cell_centers(lower=LOWER, upper=UPPER, shape=SHAPE):
+        # (prod(shape), 4) array of the cell centers in C order
+        axes = [lo + (np.arange(n) + .5) * (hi - lo) / n for lo, hi, n in zip(lower, upper, shape)]
+        return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 4)
+
+    def is_feasible(self, target_position, distance, angle):
+        # feasibility of the center of the cell containing the sample
+        if abs(target_position[2] - self.target_height) > HEIGHT_TOLERANCE:
+            return True
+        idx = np.floor((np.array([target_position[0], target_position[1], distance, angle]) - self.lower) / self.cell_size).astype(int)
+        if np.any(idx < 0) or np.any(idx >= self.feasible.shape):
+            return True
+        return bool(self.feasible[tuple(idx)])
+
+    def feasible_fraction(self):
+        return self.feasible.mean()
+
+    def save(self, filename):
+        np.savez_compressed(filename, bits=np.packbits(self.feasible), shape=self.feasible.shape,
+                            lower=self.lower, upper=self.upper, target_height=self.target_height)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        shape = tuple(data['shape'])
+        feasible = np.unpackbits(data['bits'], count=int(np.prod(shape))).reshape(shape).astype(bool)
+        return cls(feasible, data['lower'], data['upper'], float(data['target_height']))
+
+
+def build(lower=LOWER, upper=UPPER, shape=SHAPE, target_height=TARGET_HEIGHT, n_workers=None):
+    # solves look_with_angle for all cell centers in the pose planner's worker pool
+    import multiprocessing as mp
+    import os
+    from common.pose_planner import SCENARIO, _init_worker, _solve
+
+    centers = ReachabilityMap.cell_centers(lower, upper, shape)
+    samples = [([x, y, target_height], distance, angle) for x, y, distance, angle in centers]
+    n_workers = n_workers or max(1, (os.cpu_count() or 2) - 1)
+    start = time.time()
+    with mp.get_context('spawn').Pool(n_workers, initializer=_init_worker, initargs=(SCENARIO,)) as pool:
+        feasible = np.array([f for f, _ in pool.imap(_solve, samples, chunksize=16)])
+    print(f'solved {len(samples)} cells in {time.time() - start:.1f}s')
+    return ReachabilityMap(feasible.reshape(shape), lower, upper, target_height)
+
+
+if __name__ == '__main__':
+    sys.path.append(str(Path(__file__).parent.parent))
+    filename = Path(sys.argv[1]) if len(sys.argv) > 1 else MAP_FILE
+    reachability = build()
+    reachability.save(filename)
+    print(f'{reachability.feasible_fraction() * 100:.1f}% of the cells are feasible, saved to {filename}')
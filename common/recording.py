@@ -0,0 +1,326 @@
+# Record and replay of the robot interface, so the collection and preview scripts can be profiled and regression
+# tested without a robot. RecordingBot wraps a ry.BotOp and logs what the scripts read from it: camera frames of
+# getImageAndDepth / getImageDepthPcl (rgb, depth and with RECORD_POINTS the pointcloud), the joint state after
+# every sync / wait and the keys returned by getKeyPressed and wait (streams key and wait_key), each with its
+# timestamp. Every stream is a pair of append-only raw files in the recording directory (<stream>.bin with fixed
+# size records and <stream>.time with float64 timestamps), shapes and dtypes are in meta.json. Records are appended
+# with plain writes and read back as np.memmap, so a recording is never loaded into memory and a crashed recording
+# is readable up to its last complete record.
+# ReplayBot offers the same calls on a recording: frames and joint states come from the streams in order, either at
+# the recorded pace ('recorded') or as fast as they are requested ('max'), motion commands are no-ops. The end of
+# the recorded frames raises EOFError, after the recorded key presses getKeyPressed returns 'q'.
+# Streams read from different threads (e.g. frames in a CameraCapture thread, keys and joint states in the main
+# loop) are replayed in their recorded order: a thread only gets a record once the records of the other threads'
+# streams recorded before it were replayed. So a replayed session at 'max' speed sees the same frames at the same
+# key presses as the recording, as fast as the slowest thread allows. If another thread does not catch up within
+# SYNC_TIMEOUT (the script took a different path than during recording) the record is returned anyway. Both bots
+# have a clock() with the timestamp of the last record of the calling thread, CameraCapture stamps frames with it so
+# next_frame picks the same frame after a sync on record and replay.
+# Usage:
+#   bot = open_bot(C, True) # ry.BotOp, or record / replay with the RECORD / REPLAY environment variables
+#   RECORD=data/recordings/manual python table_calibration/manual_data_collection.py
+#   REPLAY=data/recordings/manual REPLAY_SPEED=max python table_calibration/manual_data_collection.py
+#   python common/recording.py data/recordings/manual # summary of a recording
+
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+from pathlib import Path
+
+
+RECORD = os.environ.get('RECORD') # directory to record the robot to, None to not record
+REPLAY = os.environ.get('REPLAY') # directory to replay instead of using the robot, None to use the robot
+REPLAY_SPEED = os.environ.get('REPLAY_SPEED', 'recorded') # 'recorded' or 'max'
+RECORD_POINTS = True # store the pointclouds, otherwise getImageDepthPcl back-projects the depth on replay
+SYNC_TIMEOUT = 5 # s
+NO_OPS = ['home', 'hold', 'moveTo', 'moveAutoTimed', 'gripperMove', 'gripperClose', 'gripperOpen', 'setControllerWriteData']
+
+
+class StreamWriter:
+    def __init__(self, directory, name):
+        self.data = open(Path(directory) / f'{name}.bin', 'ab')
+        self.time = open(Path(directory) / f'{name}.time', 'ab')
+
+    def append(self, data, timestamp):
+        self.data.write(np.ascontiguousarray(data).tobytes())
+        self.time.write(np.float64(timestamp).tobytes())
+        self.data.flush()
+        self.time.flush()
+
+    def close(self):
+        self.data.close()
+        self.time.close()
+
+
+class Recording:
+    # read access to a recording directory, every stream is a (records, ...) memmap with (records,) timestamps
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / 'meta.json', 'r') as f:
+            self.meta = json.load(f)
+
+    def streams(self):
+        return list(self.meta['streams'])
+
+    def __contains__(self, name):
+        return name in self.meta['streams']
+
+    def stream(self, name):
+        info = self.meta['streams'][name]
+        dtype, shape = np.dtype(info['dtype']), tuple(info['shape'])
+        record_size = dtype.itemsize * int(np.prod(shape))
+        data_file, time_file = self.directory / f'{name}.bin', self.directory / f'{name}.time'
+        # a partially written last record is ignored
+        n = min(data_file.stat().st_size // max(record_size, 1), time_file.stat().st_size // 8)
+        if n == 0:
+            return np.zeros((0,) + shape, dtype=dtype), np.zeros(0)
+        data = np.memmap(data_file, dtype=dtype, mode='r', shape=(n,) + shape)
+        times = np.memmap(time_file, dtype=np.float64, mode='r', shape=(n,))
+        return data, times
+
+    def start_time(self):
+        starts = [times[0] for times in (self.stream(name)[1] for name in self.streams()) if times.shape[0] > 0]
+        return min(starts) if starts else 0
+
+    def summary(self):
+        lines = [f"recording {self.directory}"]
+        for name in self.streams():
+            data, times = self.stream(name)
+            rate = (times.shape[0] - 1) / (times[-1] - times[0]) if times.shape[0] > 1 and times[-1] > times[0] else 0
+            lines.append(f"  {name}: {data.shape[0]} records of {data.shape[1:]} {data.dtype}, "
+                         f"{data.nbytes / 2**20:.1f}MB, {rate:.1f}Hz")
+        return '\n'.join(lines)
+
+
+class RecordingBot:
+    # passes every call on to bot, the camera, joint state and key press results are appended to the recording
+    def __init__(self, bot, directory, record_points=RECORD_POINTS):
+        self.bot = bot
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.record_points = record_points
+        self.meta = {'streams': {}, 'camera_fxycxy': {}}
+        if (self.directory / 'meta.json').is_file():
+            with open(self.directory / 'meta.json', 'r') as f:
+                self.meta = json.load(f)
+        self.lock = threading.Lock() # the camera is usually read from a CameraCapture thread
+        self.writers = dict()
+        self.thread_times = dict() # thread -> timestamp of the last record it appended
+        self.joint_state = None
+
+    def __getattr__(self, name):
+        if name == 'bot':
+            raise AttributeError(name) # __init__ failed before bot was set
+        return getattr(self.bot, name)
+
+    def _append(self, name, data, timestamp):
+        data = np.asarray(data)
+        with self.lock:
+            if name not in self.writers:
+                info = {'dtype': data.dtype.str, 'shape': list(data.shape)}
+                if self.meta['streams'].setdefault(name, info) != info:
+                    raise ValueError(f"Stream {name} was recorded with {self.meta['streams'][name]}, got {info}")
+                self._write_meta()
+                self.writers[name] = StreamWriter(self.directory, name)
+            self.writers[name].append(data, timestamp)
+            self.thread_times[threading.get_ident()] = timestamp
+
+    def clock(self):
+        with self.lock:
+            return self.thread_times.get(threading.get_ident(), time.time())
+
+    def _write_meta(self):
+        with open(self.directory / 'meta.json', 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+    def _record_frame(self, timestamp, sensor, rgb, depth, points=None):
+        # frames are stamped with the start of the call, the capture of a frame requested before a sync began before
+        if points is None and sensor not in self.meta['camera_fxycxy']:
+            self.getCameraFxycxy(sensor) # needed to back-project the depth on replay
+        self._append(f'{sensor}_rgb', rgb, timestamp)
+        self._append(f'{sensor}_depth', depth, timestamp)
+        if points is not None:
+            self._append(f'{sensor}_points', points, timestamp)
+
+    def _record_joint_state(self, C):
+        self.joint_state = C.getJointState()
+        self._append('joint_state', self.joint_state, time.time())
+
+    def close(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.close()
+            self.writers = dict()
+
+    def __del__(self):
+        if 'writers' in self.__dict__:
+            self.close()
+
+    def getImageAndDepth(self, sensor):
+        timestamp = time.time()
+        if self.record_points:
+            # all frames of a sensor have a pointcloud, so the streams stay aligned
+            rgb, depth, points = self.bot.getImageDepthPcl(sensor)
+            self._record_frame(timestamp, sensor, rgb, depth, points)
+        else:
+            rgb, depth = self.bot.getImageAndDepth(sensor)
+            self._record_frame(timestamp, sensor, rgb, depth)
+        return rgb, depth
+
+    def getImageDepthPcl(self, sensor, globalCoordinates=False):
+        timestamp = time.time()
+        rgb, depth, points = self.bot.getImageDepthPcl(sensor, globalCoordinates=globalCoordinates)
+        self._record_frame(timestamp, sensor, rgb, depth, points if self.record_points else None)
+        return rgb, depth, points
+
+    def getCameraFxycxy(self, sensor):
+        fxycxy = self.bot.getCameraFxycxy(sensor)
+        with self.lock:
+            self.meta['camera_fxycxy'][sensor] = [float(v) for v in fxycxy]
+            self._write_meta()
+        return fxycxy
+
+    def getKeyPressed(self):
+        key = self.bot.getKeyPressed()
+        self._append('key', np.int32(key), time.time())
+        return key
+
+    def sync(self, C, *args, **kwargs):
+        result = self.bot.sync(C, *args, **kwargs)
+        self._record_joint_state(C)
+        return result
+
+    def wait(self, C, *args, **kwargs):
+        result = self.bot.wait(C, *args, **kwargs)
+        self._record_joint_state(C)
+        self._append('wait_key', np.int32(result or 0), time.time()) # the key of a wait for a key press
+        return result
+
+    def getJointState(self):
+        return self.joint_state
+
+
+class ReplayBot:
+    # the BotOp calls of the scripts on a recording, see the header for the replay rules
+    thread_safe = True # SerializedBot does not need to lock it, which would block the ordered replay
+    def __init__(self, C, directory, speed=REPLAY_SPEED, view=False):
+        if speed not in ['recorded', 'max']:
+            raise ValueError("Invalid speed option")
+        self.recording = Recording(directory)
+        self.speed = speed
+        self.view = view
+        self.streams = {name: self.recording.stream(name) for name in self.recording.streams()}
+        self.cursors = {name: 0 for name in self.streams}
+        self.t0 = self.recording.start_time()
+        self.start = time.time()
+        self.advanced = threading.Condition() # notified whenever a cursor advances
+        self.owners = dict() # stream -> thread reading it
+        self.thread_times = dict() # thread -> recorded time of the last record it got
+        self.joint_state = C.getJointState()
+
+    def __getattr__(self, name):
+        if name in NO_OPS:
+            return lambda *args, **kwargs: None
+        raise AttributeError(f"ReplayBot has no {name}")
+
+    def _pending_before(self, timestamp, thread):
+        # whether a stream of another thread still has a record from before timestamp
+        for name, owner in self.owners.items():
+            times = self.streams[name][1]
+            if owner != thread and self.cursors[name] < times.shape[0] and times[self.cursors[name]] < timestamp:
+                return True
+        return False
+
+    def _next(self, name):
+        # index of the next record of a stream, None at its end. It is returned once the earlier records of the
+        # other threads were replayed and, at the recorded pace, not before the time of the record.
+        thread = threading.get_ident()
+        with self.advanced:
+            if name not in self.streams or self.cursors[name] >= self.streams[name][1].shape[0]:
+                return None
+            self.owners[name] = thread # the thread that read it last, e.g. the camera is initialized from the main thread
+            i = self.cursors[name]
+            timestamp = self.streams[name][1][i]
+            self.advanced.wait_for(lambda: not self._pending_before(timestamp, thread), SYNC_TIMEOUT)
+            self.cursors[name] += 1
+            self.thread_times[thread] = timestamp
+            self.advanced.notify_all()
+        if self.speed == 'recorded':
+            delay = self.streams[name][1][i] - self.t0 - (time.time() - self.start)
+            if delay > 0:
+                time.sleep(delay)
+        return i
+
+    def clock(self):
+        # replay time of the calling thread, CameraCapture stamps frames with it
+        with self.advanced:
+            return self.thread_times.get(threading.get_ident(), self.t0)
+
+    def _next_frame(self, sensor):
+        i = self._next(f'{sensor}_rgb')
+        if i is None:
+            raise EOFError(f"End of the recorded {sensor} frames")
+        rgb = self.streams[f'{sensor}_rgb'][0][i]
+        depth = self.streams[f'{sensor}_depth'][0][i]
+        points = self.streams[f'{sensor}_points'][0][i] if f'{sensor}_points' in self.streams else None
+        return np.array(rgb), np.array(depth), points
+
+    def _joint_state(self, C):
+        i = self._next('joint_state')
+        if i is not None:
+            self.joint_state = np.array(self.streams['joint_state'][0][i])
+        C.setJointState(self.joint_state)
+
+    def getImageAndDepth(self, sensor):
+        rgb, depth, _ = self._next_frame(sensor)
+        return rgb, depth
+
+    def getImageDepthPcl(self, sensor, globalCoordinates=False):
+        if globalCoordinates:
+            raise ValueError("Invalid globalCoordinates option, replayed pointclouds are in the camera frame")
+        rgb, depth, points = self._next_frame(sensor)
+        if points is None:
+            # rai camera convention, the camera looks along -z and image rows point along -y
+            fx, fy, cx, cy = self.getCameraFxycxy(sensor)
+            v, u = np.indices(depth.shape, dtype=np.float32)
+            points = np.stack([depth * (u - cx) / fx, -depth * (v - cy) / fy, -depth], axis=-1)
+        return rgb, depth, np.array(points)
+
+    def getCameraFxycxy(self, sensor):
+        return np.array(self.recording.meta['camera_fxycxy'][sensor])
+
+    def getKeyPressed(self):
+        i = self._next('key')
+        return ord('q') if i is None else int(self.streams['key'][0][i])
+
+    def sync(self, C, waitTime=.1, viewMsg=''):
+        self._joint_state(C)
+        if self.view:
+            C.view(False, viewMsg)
+
+    def wait(self, C, forKeyPressed=False, forTimeToEnd=True, forGripper=False):
+        self._joint_state(C)
+        i = self._next('wait_key')
+        return 0 if i is None else int(self.streams['wait_key'][0][i])
+
+    def getJointState(self):
+        return self.joint_state
+
+
+def open_bot(C, useRealRobot, record=RECORD, replay=REPLAY):
+    # drop-in for ry.BotOp(C, useRealRobot) in the scripts
+    if replay is not None:
+        return ReplayBot(C, replay)
+    import robotic as ry
+    bot = ry.BotOp(C, useRealRobot)
+    return RecordingBot(bot, record) if record is not None else bot
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python recording.py recording_dir')
+        sys.exit(1)
+    print(Recording(sys.argv[1]).summary())
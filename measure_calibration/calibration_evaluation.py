@@ -0,0 +1,93 @@
+# Evaluation of many candidate camera calibrations at once. A candidate is the camera pose relative to PARENT_FRAME,
+# an observation is a marker position measured in the camera frame together with the transform base <- parent of
+# its joint state and the ground truth marker position in the base frame. The base frame positions of all
+# observations under all candidates are one batched (candidates, observations, 3) product, so comparing hundreds of
+# calibrations (different solvers, bootstrap fits, ...) costs about the same as comparing four.
+# compare_calibrations_measurement.py stores its observations in OBSERVATIONS_FILE, running this file evaluates the
+# calibrations in CANDIDATES on them.
+
+import time
+import sys
+import numpy as np
+import robotic as ry
+from pathlib import Path
+from scipy.spatial.transform import Rotation
+
+root = Path(__file__).parent.parent
+sys.path.append(str(root))
+from common.kinematics_cache import KinematicsCache, cache_file
+
+PARENT_FRAME = 'l_panda_joint7'
+OBSERVATIONS_FILE = root / 'data' / 'comparison_observations_v3.npz'
+CANDIDATES = { # camera poses relative to PARENT_FRAME as [x, y, z, qw, qx, qy, qz]
+    'table_calibrated_camera': [-0.0209509, 0.0471966, 0.17127, 0.386655, 0.0133645, -0.00307343, -0.922122],
+    'aruco_calibrated_camera_20_poses': [-0.0226106, 0.0513997, 0.169131, 0.389766, 0.00753701, -0.00502238, -0.920869],
+    'aruco_calibrated_camera_100_poses': [-0.0245442, 0.0477194, 0.16876, 0.393552, 0.00961641, -0.00293342, -0.919247],
+}
+
+
+def poses_from_Q(Q):
+    # (C, 7) rai poses [x, y, z, qw, qx, qy, qz] -> (C, 4, 4) transforms
+    Q = np.atleast_2d(np.asarray(Q, dtype=np.float64))
+    T = np.zeros((Q.shape[0], 4, 4))
+    T[:, :3, :3] = Rotation.from_quat(np.roll(Q[:, 3:], -1, axis=1)).as_matrix()
+    T[:, :3, 3] = Q[:, :3]
+    T[:, 3, 3] = 1
+    return T
+
+
+def base_positions(candidates, parent_transforms, points):
+    # candidates (C, 4, 4) camera in parent, parent_transforms (K, 4, 4) parent in base, points (K, 3) in the camera
+    # frame -> (C, K, 3) positions in the base frame
+    # both rotations as batched matmuls, (K, 3) @ (C, 3, 3) and then (K, C, 3) @ (K, 3, 3), which is several times
+    # faster than the equivalent einsums
+    in_parent = points @ np.swapaxes(candidates[:, :3, :3], 1, 2) + candidates[:, None, :3, 3]
+    in_base = np.swapaxes(in_parent, 0, 1) @ np.swapaxes(parent_transforms[:, :3, :3], 1, 2)
+    return np.swapaxes(in_base, 0, 1) + parent_transforms[None, :, :3, 3]
+
+
+def evaluate(candidates, parent_transforms, points, ground_truth):
+    # errors of all candidates against the ground truth (K, 3) and their summary statistics, each (C, ...)
+    errors = base_positions(candidates, parent_transforms, points) - ground_truth[None]
+    distances = np.linalg.norm(errors, axis=-1)
+    return {
+        'errors': errors,
+        'distances': distances,
+        'mean': distances.mean(axis=1),
+        'rms': np.sqrt(np.mean(distances**2, axis=1)),
+        'median': np.median(distances, axis=1),
+        'max': distances.max(axis=1),
+        'bias': errors.mean(axis=1)
+    }
+
+
+def save_observations(filename, joint_states, points, marker_ids, ground_truth):
+    np.savez(filename, joint_states=joint_states, points=points, marker_ids=marker_ids, ground_truth=ground_truth)
+
+
+def load_observations(C, filename=OBSERVATIONS_FILE):
+    # the observations with the base <- parent transforms of their joint states from the kinematics cache
+    data = np.load(filename)
+    fk = KinematicsCache(C, data['joint_states'], cache_file(filename))
+    return fk.relative(PARENT_FRAME, to='l_panda_base'), data['points'], data['marker_ids'], data['ground_truth']
+
+
+def main():
+    C = ry.Config()
+    C.addFile(ry.raiPath('scenarios/pandaSingle_camera.g'))
+    parent_transforms, points, marker_ids, ground_truth = load_observations(C)
+
+    names = list(CANDIDATES) + ['l_cameraWrist_o']
+    camera_o = np.linalg.inv(C.getFrame(PARENT_FRAME).getTransform()) @ C.getFrame('l_cameraWrist_o').getTransform()
+    candidates = np.concatenate([poses_from_Q(list(CANDIDATES.values())), camera_o[None]])
+
+    start = time.perf_counter()
+    result = evaluate(candidates, parent_transforms, points, ground_truth)
+    print(f'evaluated {len(names)} calibrations on {points.shape[0]} observations in {(time.perf_counter() - start) * 1e3:.2f}ms')
+    for j, name in enumerate(names):
+        print(f"{name:36s} mean {result['mean'][j]:.4f}m, rms {result['rms'][j]:.4f}m, max {result['max'][j]:.4f}m, "
+              f"bias {np.round(result['bias'][j], 4).tolist()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# Error metrics of the calibration comparison (compare_calibrations_measurement.py). The results of all calibrations
+# are flattened into one (observations, 3) error array with the calibration index and marker id of every row, all
+# statistics (mean, rms, percentiles and per axis bias, per calibration and per calibration and marker) are computed
+# from it with grouped reductions. Everything is cached in CACHE_DIR keyed by the sha1 of the results file and the
+# ground truth, so repeated runs on the same results neither build a ry.Config nor recompute anything.
+# Usage:
+#   metrics = load_metrics(root / 'data/comparison_results_v3.pkl')
+#   metrics['rms'] # (calibrations,), metrics['marker_rms'] # (calibrations, markers)
+
+import hashlib
+import pickle
+import numpy as np
+from pathlib import Path
+from parse_arucos import parse_arucos
+
+root = Path(__file__).parent.parent
+RESULTS_FILE = root / 'data' / 'comparison_results_v3.pkl'
+CACHE_DIR = root / 'data' / 'metrics_cache'
+CALIBRATIONS = ['Table Calibrated Camera', 'Aruco Calibrated Camera (20 Poses)', 'Aruco Calibrated Camera (100 Poses)',
+                'Old Calibration']
+PERCENTILES = [50, 90, 95]
+GROUND_TRUTH = """aruco_0(table): { Q: [-0.462927, -0.139256, 0.05076], shape: marker, size: [.05] }
+aruco_1(table): { Q: [0.359713, -0.153013, 0.0508287], shape: marker, size: [.05] }
+aruco_4(table): { Q: [0.126525, 0.353908, 0.0516191], shape: marker, size: [.05] }
+aruco_6(table): { Q: [-0.124805, 0.405355, 0.0499016], shape: marker, size: [.05] }
+aruco_11(table): { Q: [0.302758, 0.15373, 0.0514353], shape: marker, size: [.05] }
+aruco_12(table): { Q: [-0.33829, 0.191526, 0.0497731], shape: marker, size: [.05] }
+aruco_14(table): { Q: [0.0428602, 0.179035, 0.0510892], shape: marker, size: [.05] }"""
+
+
+def ground_truth_positions(gt_string=GROUND_TRUTH):
+    # marker positions in l_panda_base, the parents are resolved with the g-file once and then cached with the metrics
+    import robotic as ry
+    C = ry.Config()
+    C.addFile(ry.raiPath('/scenarios/pandaSingle.g'))
+    base = np.linalg.inv(C.getFrame('l_panda_base').getTransform())
+    gt = dict()
+    for id, (parent, position) in parse_arucos(gt_string).items():
+        T = base @ C.getFrame(parent).getTransform()
+        gt[id] = T[:3, :3] @ np.array(position) + T[:3, 3]
+    return gt
+
+
+def flatten_results(results, gt):
+    # list (calibrations) of dicts marker id -> list of base positions -> errors (K, 3), calibration index and
+    # marker id per row
+    errors, calibration, marker_ids = [], [], []
+    for j, result in enumerate(results):
+        for id, positions in result.items():
+            positions = np.asarray(positions).reshape(-1, 3)
+            errors.append(positions - gt[id])
+            calibration.append(np.full(positions.shape[0], j))
+            marker_ids.append(np.full(positions.shape[0], id))
+    return np.concatenate(errors), np.concatenate(calibration), np.concatenate(marker_ids)
+
+
+def grouped_stats(errors, groups, n_groups, prefix=''):
+    # mean / rms / max distance, mean xy distance, per axis bias and distance percentiles for every group
+    distances = np.linalg.norm(errors, axis=1)
+    xy_distances = np.linalg.norm(errors[:, :2], axis=1)
+    counts = np.bincount(groups, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats = {
+            'count': counts,
+            'mean': np.bincount(groups, distances, n_groups) / counts,
+            'mean_xy': np.bincount(groups, xy_distances, n_groups) / counts,
+            'rms': np.sqrt(np.bincount(groups, distances**2, n_groups) / counts),
+            'bias': np.stack([np.bincount(groups, errors[:, k], n_groups) for k in range(3)], axis=1) / counts[:, None]
+        }
+    # percentiles and max need the distances of each group, sorted by group once
+    order = np.lexsort((distances, groups))
+    starts = np.searchsorted(groups[order], np.arange(n_groups))
+    sorted_distances = distances[order]
+    percentiles = np.full((n_groups, len(PERCENTILES)), np.nan)
+    maxima = np.full(n_groups, np.nan)
+    for g in np.flatnonzero(counts):
+        group = sorted_distances[starts[g]:starts[g] + counts[g]]
+        percentiles[g] = np.percentile(group, PERCENTILES)
+        maxima[g] = group[-1]
+    stats['percentiles'] = percentiles
+    stats['max'] = maxima
+    return {prefix + key: value for key, value in stats.items()}
+
+
+def compute_metrics(results, gt):
+    errors, calibration, marker_ids = flatten_results(results, gt)
+    markers, marker_idx = np.unique(marker_ids, return_inverse=True)
+    n_calibrations = len(results)
+    metrics = {'errors': errors, 'calibration': calibration, 'marker_ids': marker_ids, 'markers': markers,
+               'gt_ids': np.array(sorted(gt)), 'gt_positions': np.array([gt[id] for id in sorted(gt)])}
+    metrics.update(grouped_stats(errors, calibration, n_calibrations))
+    # per (calibration, marker) pair, reshaped to (calibrations, markers, ...)
+    pair_stats = grouped_stats(errors, calibration * len(markers) + marker_idx.ravel(), n_calibrations * len(markers),
+                               prefix='marker_')
+    metrics.update({key: value.reshape((n_calibrations, len(markers)) + value.shape[1:])
+                    for key, value in pair_stats.items()})
+    return metrics
+
+
+def cache_key(filename, gt_string=GROUND_TRUTH):
+    h = hashlib.sha1(Path(filename).read_bytes())
+    h.update(gt_string.encode())
+    h.update(str(PERCENTILES).encode())
+    return h.hexdigest()
+
+
+def load_metrics(filename=RESULTS_FILE, gt_string=GROUND_TRUTH, cache_dir=CACHE_DIR):
+    cached = Path(cache_dir) / f'{cache_key(filename, gt_string)}.npz'
+    if cached.is_file():
+        with np.load(cached) as data:
+            return dict(data)
+    with open(filename, 'rb') as f:
+        results = pickle.load(f)
+    metrics = compute_metrics(results, ground_truth_positions(gt_string))
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    np.savez(cached, **metrics)
+    return metrics
+
+
+def report(metrics, names=CALIBRATIONS):
+    lines = []
+    for j, name in enumerate(names[:len(metrics['rms'])]):
+        lines.append(f"{name}: n={metrics['count'][j]}, mean {metrics['mean'][j] * 1e3:.2f}mm "
+                     f"(xy {metrics['mean_xy'][j] * 1e3:.2f}mm), rms {metrics['rms'][j] * 1e3:.2f}mm, "
+                     f"p{'/p'.join(map(str, PERCENTILES))} {'/'.join(f'{p * 1e3:.2f}' for p in metrics['percentiles'][j])}mm, "
+                     f"max {metrics['max'][j] * 1e3:.2f}mm, bias {np.round(metrics['bias'][j] * 1e3, 2).tolist()}mm")
+        for k, id in enumerate(metrics['markers']):
+            if metrics['marker_count'][j, k] == 0:
+                continue
+            lines.append(f"  marker {id}: n={metrics['marker_count'][j, k]}, mean {metrics['marker_mean'][j, k] * 1e3:.2f}mm, "
+                         f"rms {metrics['marker_rms'][j, k] * 1e3:.2f}mm, bias {np.round(metrics['marker_bias'][j, k] * 1e3, 2).tolist()}mm")
+    return '\n'.join(lines)
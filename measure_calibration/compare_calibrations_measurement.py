@@ -6,8 +6,17 @@ from cv2 import aruco
 import pickle
 from pathlib import Path
 import random
+import sys
 
-def look_at_marker_ik(C, marker_name, distance=0.2):
+root = Path(__file__).parent.parent
+sys.path.append(str(root))
+from common.ik_cache import IKCache, camera_calibration
+from common.kinematics_cache import KinematicsCache
+from calibration_evaluation import CANDIDATES, PARENT_FRAME, OBSERVATIONS_FILE, poses_from_Q, base_positions, save_observations
+
+ik_cache = IKCache(root / 'data' / 'ik_cache.json')
+
+def look_at_marker_komo(C, marker_name, distance=0.2):
     komo = ry.KOMO(C, 1, 1, 0, True)
     komo.addControlObjective([], 0), 1e-1
     komo.addObjective([], ry.FS.accumulatedCollisions, [], ry.OT.eq)
@@ -18,36 +27,24 @@ def look_at_marker_ik(C, marker_name, distance=0.2):
     komo.addObjective([], ry.FS.scalarProductZZ, ['origin', 'l_cameraWrist'], ry.OT.ineq)
     komo.addObjective([], ry.FS.scalarProductXY, ['l_cameraWrist', 'origin'], ry.OT.eq)
     komo.addObjective([], ry.FS.scalarProductYY, ['origin', 'l_cameraWrist'], ry.OT.ineq)
+    return komo
 
-    ret = ry.NLP_Solver(komo.nlp(), verbose=-1).solve()
-    print(ret)
-    return komo.getPath()[-1]
-
-def invert_transform(T):
-    T_inv = np.eye(4)
-    R_inv = T[:3, :3].T
-    T_inv[:3, :3] = R_inv
-    T_inv[:3, 3] = -R_inv @ T[:3, 3]
-    return T_inv
-
-def cam_to_base(C: ry.Config, cam_frame, coords):
-    coords = np.array([*coords, 1])
-    cam = C.getFrame(cam_frame)
-    base = C.getFrame('l_panda_base')
-    return invert_transform(base.getTransform()) @ cam.getTransform() @ coords
 
+def look_at_marker_ik(C, marker_name, distance=0.2):
+    # the marker positions are fixed, so every round after the first is a cache hit (until the camera is recalibrated)
+    params = C.getFrame(marker_name).getPosition().tolist() + [distance]
+    return ik_cache.solve(('look_at_marker', marker_name, camera_calibration(C)), params,
+                          lambda: look_at_marker_komo(C, marker_name, distance))
 
 C = ry.Config()
 C.addFile(ry.raiPath('/scenarios/pandaSingle_camera.g'))
-C.addFrame('table_calibrated_camera', 'l_panda_joint7').setRelativePose([-0.0209509, 0.0471966, 0.17127, 0.386655, 0.0133645, -0.00307343, -0.922122])
-C.addFrame('aruco_calibrated_camera_20_poses', 'l_panda_joint7').setRelativePose([-0.0226106, 0.0513997, 0.169131, 0.389766, 0.00753701, -0.00502238, -0.920869])
-C.addFrame('aruco_calibrated_camera_100_poses', 'l_panda_joint7').setRelativePose([-0.0245442, 0.0477194, 0.16876, 0.393552, 0.00961641, -0.00293342, -0.919247])
+for name, Q in CANDIDATES.items():
+    C.addFrame(name, PARENT_FRAME).setRelativePose(Q)
 
-root = Path(__file__).parent.parent
 h5 = H5Reader(root / 'data/marker_gt_new.h5')
 manifest = h5.read_dict('manifest')
 
-gt_pos = []
+gt_pos = dict()
 gt_opti_output = """optimal aruco_0 position: [0.0616964, 0.466489, -0.00147755]
 optimal aruco_1 position: [0.0457536, -0.363669, -0.00128368]
 optimal aruco_4 position: [0.558125, -0.128908, 0.00324898]
@@ -61,17 +58,16 @@ for line in gt_opti_output.split('\n'):
     marker = C.addFrame(f'marker_{id}', 'l_panda_base')
     marker.setShape(ry.ST.marker, [.05]).setColor([1,0,0,.5])
     pos = eval(pos_str)
-    gt_pos.append(pos)
+    gt_pos[id] = pos
     marker.setRelativePosition(pos)
     print(f'marker {id} position: {pos}')
-gt_pos = np.array(gt_pos)
 
 aruco_dict = aruco.Dictionary_get(aruco.DICT_6X6_100)
 
 bot = ry.BotOp(C, True)
 bot.getImageAndDepth('l_cameraWrist') # initialize camera
 
-results = [dict(), dict(), dict(), dict()]
+joint_states, cam_positions, observed_ids = [], [], []
 markers = manifest['marker_ids'].copy()
 for i in range(5):
     random.shuffle(markers)
@@ -90,9 +86,29 @@ for i in range(5):
         corners = corners[idx].squeeze().astype("int")
         corner_points = pcl[corners[:,1],corners[:,0]]
         cam_position = corner_points[0]
-        for j, cam in enumerate(['table_calibrated_camera', 'aruco_calibrated_camera_20_poses', 'aruco_calibrated_camera_100_poses', 'l_cameraWrist_o']):
-            base_coords = cam_to_base(C, cam, cam_position)
-            results[j].setdefault(id, []).append(base_coords[:3])
+        joint_states.append(C.getJointState())
+        cam_positions.append(cam_position)
+        observed_ids.append(id)
+
+ik_cache.save()
+print(ik_cache.summary())
+
+# all calibrations are evaluated on all observations at once, see calibration_evaluation.py
+joint_states = np.array(joint_states)
+cam_positions = np.array(cam_positions)
+observed_ids = np.array(observed_ids)
+ground_truth = np.array([gt_pos[id] for id in observed_ids])
+save_observations(OBSERVATIONS_FILE, joint_states, cam_positions, observed_ids, ground_truth)
+
+parent_transforms = KinematicsCache(C, joint_states).relative(PARENT_FRAME, to='l_panda_base')
+camera_o = np.linalg.inv(C.getFrame(PARENT_FRAME).getTransform()) @ C.getFrame('l_cameraWrist_o').getTransform()
+candidates = np.concatenate([poses_from_Q(list(CANDIDATES.values())), camera_o[None]])
+base_coords = base_positions(candidates, parent_transforms, cam_positions)
+
+results = [dict() for _ in candidates]
+for j in range(len(candidates)):
+    for id, coords in zip(observed_ids, base_coords[j]):
+        results[j].setdefault(int(id), []).append(coords)
 
 with open(root / 'data/comparison_results_v3.pkl', 'xb') as f:      
     pickle.dump(results, f)
@@ -1,12 +1,21 @@
 import robotic as ry
 import numpy as np
 from matplotlib.pyplot import get_cmap
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from common.camera_capture import CameraCapture, SerializedBot
+from common.recording import open_bot
 
 camera = 'l_cameraWrist'
+Z_MIN = 0.58 # heights between Z_MIN and Z_MIN + Z_RANGE are spread over the colormap
+Z_RANGE = 0.04
 
 C = ry.Config()
 C.addFile(ry.raiPath("scenarios/pandaSingle_camera.g"))
-bot = ry.BotOp(C, True)
+bot = SerializedBot(open_bot(C, True)) # shared with the capture thread
 pcl = C.addFrame("pcl")
 bot.getImageAndDepth('l_cameraWrist') # initialize camera
 print('Camera Initialized')
@@ -14,19 +23,55 @@ C.addFrame('cam_coords', camera).setShape(ry.ST.marker, [.1])
 
 C.getFrame('table').setColor([.2,.2])
 
-plasma = get_cmap("plasma", 256)
+# 256 entry uint8 lookup table, so colouring is one np.take per frame instead of evaluating the colormap per point
+plasma_lut = (get_cmap("plasma", 256)(np.arange(256))[:, :3] * 255).astype(np.uint8)
+
+cam = CameraCapture(bot, 'l_cameraWrist').start() # frames are processed at camera rate, the viewer syncs at its own
+
+# float32 buffers, allocated for the first frame and reused afterwards
+points_global = points_buffer = z_idx = z_buffer = z_nan = color = None
 
 bot.hold(floating=True, damping=False)
+last_frame = -1
+fps = 0
+latency = 0
+last_time = time.time()
 while bot.getKeyPressed() != ord('q'):
-    rgb, _, points = bot.getImageDepthPcl('l_cameraWrist')
+    frame = cam.latest()
+    if frame is not None and frame.index != last_frame:
+        last_frame = frame.index
+        points = frame.points.reshape(-1, 3)
+        if points_global is None or points_global.shape[0] != points.shape[0]:
+            points_global = np.empty(points.shape, dtype=np.float32)
+            points_buffer = np.empty(points.shape, dtype=np.float32) # float64 frames are converted into it
+            z_buffer = np.empty(points.shape[0], dtype=np.float32)
+            z_nan = np.empty(points.shape[0], dtype=bool)
+            z_idx = np.empty(points.shape[0], dtype=np.uint8)
+            color = np.empty((points.shape[0], 3), dtype=np.uint8)
+
+        if points.dtype != np.float32:
+            np.copyto(points_buffer, points)
+            points = points_buffer
+        cam_transform = C.getFrame(camera).getTransform().astype(np.float32)
+        np.matmul(points, cam_transform[:3, :3].T, out=points_global)
+        points_global += cam_transform[:3, 3]
 
-    cam_transform = C.getFrame(camera).getTransform()
-    points_global = points.reshape(-1, 3) @ cam_transform[:3, :3].T + cam_transform[:3, 3]
-    z_normed = np.clip((points_global[:,2]-0.58)/0.04, 0,1)
+        # z -> [0, 255] -> lut index
+        np.subtract(points_global[:, 2], Z_MIN, out=z_buffer)
+        z_buffer *= 255 / Z_RANGE
+        np.clip(z_buffer, 0, 255, out=z_buffer)
+        np.isnan(z_buffer, out=z_nan) # missing depth, casting nan to uint8 is undefined
+        np.copyto(z_buffer, 0, where=z_nan)
+        np.copyto(z_idx, z_buffer, casting='unsafe')
+        np.take(plasma_lut, z_idx, axis=0, out=color)
 
-    color = (plasma(z_normed)[:,:3]*255).astype(np.uint8)
+        pcl.setPointCloud(points_global, color)
 
-    pcl.setPointCloud(points_global, color)
-    bot.sync(C)
+        now = time.time()
+        fps = 0.9 * fps + 0.1 / max(now - last_time, 1e-6) # smoothed over the last ~10 frames
+        latency = now - frame.timestamp
+        last_time = now
+    bot.sync(C, viewMsg=f'{fps:.1f} fps, latency {latency * 1e3:.0f}ms')
 
+cam.stop()
 bot.hold(floating=False)
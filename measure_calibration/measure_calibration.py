@@ -1,5 +1,10 @@
 import robotic as ry
 import numpy as np
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from common.pcl_preprocessing import valid_mask
 
 camera = 'l_cameraWrist_o' # new calib, use 'l_cameraWrist_o' for old calib
 
@@ -40,15 +45,16 @@ def main():
     u_coords = np.linspace(0,1, points.shape[1])
     u, v = np.meshgrid(u_coords, v_coords)
     cam_pixels = np.stack([u, v, depth, np.ones_like(u)], axis=-1)
-    X = cam_pixels.reshape(-1, 4)
+    valid = valid_mask(points.reshape(-1, 3)) # holes in the depth image would distort the fit and the statistics
+    X = cam_pixels.reshape(-1, 4)[valid]
     cam_transform = C.getFrame(camera).getTransform()
-    Y = points.reshape(-1, 3) @ cam_transform[:3, :3].T + cam_transform[:3, 3]
+    Y = points.reshape(-1, 3)[valid] @ cam_transform[:3, :3].T + cam_transform[:3, 3]
     P = Y.T @ X @ np.linalg.inv(X.T @ X)
     t = P[:,3]
     R, K = np.linalg.qr(P[:,:4])
 
     pcl = C.addFrame("pcl")
-    pcl.setPointCloud(Y, rgb.reshape(-1,3))
+    pcl.setPointCloud(Y, rgb.reshape(-1,3)[valid])
     C.view(True)
     del bot
     del C
@@ -1,106 +1,80 @@
+# Renders the calibration comparison of compare_calibrations_measurement.py headlessly into FIGURE_DIR and writes the
+# metrics report (see calibration_metrics.py) next to the figures. Set SHOW = True to also open the windows.
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
-import pickle
 from pathlib import Path
-from robotic.src.h5_helper import H5Reader
-from parse_arucos import parse_arucos
-import robotic as ry
+from calibration_metrics import RESULTS_FILE, CALIBRATIONS, load_metrics, report
 
-cam_names = ['Table Calibrated Camera', 'Aruco Calibrated Camera (20 Poses)', 'Aruco Calibrated Camera (100 Poses)', 'Old Calibration']
+SHOW = False
+if not SHOW:
+    matplotlib.use('Agg')
 
 root = Path(__file__).parent.parent
-print(root, Path(__file__))
+FIGURE_DIR = root / 'data' / 'figures'
 
-with open(root / 'data/comparison_results_v3.pkl', 'rb') as f:
-    results = pickle.load(f)
+metrics = load_metrics(RESULTS_FILE)
+errors, calibration, marker_ids = metrics['errors'], metrics['calibration'], metrics['marker_ids']
+gt_pos = dict(zip(metrics['gt_ids'], metrics['gt_positions']))
+cam_names = CALIBRATIONS
 
-gt_pos = dict()
-C = ry.Config()
-C.addFile(ry.raiPath('/scenarios/pandaSingle.g'))
-gt_opti_output = """aruco_0(table): { Q: [-0.462927, -0.139256, 0.05076], shape: marker, size: [.05] }
-aruco_1(table): { Q: [0.359713, -0.153013, 0.0508287], shape: marker, size: [.05] }
-aruco_4(table): { Q: [0.126525, 0.353908, 0.0516191], shape: marker, size: [.05] }
-aruco_6(table): { Q: [-0.124805, 0.405355, 0.0499016], shape: marker, size: [.05] }
-aruco_11(table): { Q: [0.302758, 0.15373, 0.0514353], shape: marker, size: [.05] }
-aruco_12(table): { Q: [-0.33829, 0.191526, 0.0497731], shape: marker, size: [.05] }
-aruco_14(table): { Q: [0.0428602, 0.179035, 0.0510892], shape: marker, size: [.05] }"""
-for id, (parent, position) in parse_arucos(gt_opti_output).items():
-    marker = C.addFrame(f'marker_{id}', parent).setRelativePosition(position)
-    rel_marker = C.addFrame(f'marker_rel_{id}', 'l_panda_base').setPosition(marker.getPosition())
-    gt_pos[id] = np.array(rel_marker.getRelativePosition())
+FIGURE_DIR.mkdir(parents=True, exist_ok=True)
+text = report(metrics, cam_names)
+print(text)
+(FIGURE_DIR / 'comparison_report.txt').write_text(text + '\n')
 
-# lets plot the results - combined
+
+def add_circles(ax):
+    # circles for 1, 2 cm error
+    for r in [0.01, 0.02]:
+        ax.add_artist(plt.Circle((0, 0), r, color='gray', fill=False, linestyle='--'))
+    ax.set_xlim(-0.02, 0.02)
+    ax.set_ylim(-0.02, 0.02)
+    ax.grid(True)
+
+
+# combined
 f, ax = plt.subplots(1,1, figsize=(10,10))
 ax.set_title('Calibration Error Comparison')
 ax.set_xlabel('Error along x-axis (m)')
 ax.set_ylabel('Error along y-axis (m)')
 ax.axis('equal')
-
-# add circles for 1,2 cm error
-for r in [0.01, 0.02]:
-    circle = plt.Circle((0, 0), r, color='gray', fill=False, linestyle='--')
-    ax.add_artist(circle)
-ax.set_xlim(-0.02, 0.02)
-ax.set_ylim(-0.02, 0.02)
-ax.grid(True)
-
-
-for j, (name, res) in enumerate(zip(cam_names, results)):
-    all_points = []
-    for id, points in res.items():
-        all_points.append(np.array(points) - gt_pos[id])
-    points = np.vstack(all_points)
-    print('average error for', name, np.mean(np.linalg.norm(points[:2,:], axis=-1)))
+add_circles(ax)
+for j, name in enumerate(cam_names):
+    points = errors[calibration == j]
     ax.scatter(points[:,0], points[:,1], label=name)
-
 ax.legend()
-plt.show()
+f.savefig(FIGURE_DIR / 'comparison_combined.png', dpi=100)
 
-# lets plot the results
+# per marker, for the first two calibrations
 f, axs = plt.subplots(1,2, figsize=(20,10))
-# add circles for 1,2,3,4 cm error
-for r in [0.01, 0.02]:
-    circle1 = plt.Circle((0, 0), r, color='gray', fill=False, linestyle='--')
-    circle2 = plt.Circle((0, 0), r, color='gray', fill=False, linestyle='--')
-    axs[0].add_artist(circle1)
-    axs[1].add_artist(circle2)
-
-axs[0].grid(True)
-axs[1].grid(True)
-
-for j, (name, res) in enumerate(zip(cam_names[:2], results[:2])):
-    ax = axs[j]
+for j, (name, ax) in enumerate(zip(cam_names[:2], axs)):
     ax.set_title(name)
     ax.set_xlabel('Error along x-axis (m)')
     ax.set_ylabel('Error along y-axis (m)')
     ax.axis('equal')
-    for id, points in res.items():
-        points = np.array(points) - gt_pos[id]
+    add_circles(ax)
+    for id in metrics['markers']:
+        points = errors[(calibration == j) & (marker_ids == id)]
         ax.scatter(points[:,0], points[:,1], label=f'Marker {id}')
-    
-
-axs[0].set_xlim(-0.02, 0.02)
-axs[0].set_ylim(-0.02, 0.02)
-axs[1].set_xlim(-0.02, 0.02)
-axs[1].set_ylim(-0.02, 0.02)
 axs[1].legend()
-plt.tight_layout()
-plt.show()
+f.tight_layout()
+f.savefig(FIGURE_DIR / 'comparison_per_marker.png', dpi=100)
 
+# errors over the marker position, table calibration
 f, axs = plt.subplots(1,2, figsize=(20,10), sharex=True, sharey=True)
-
 axs[0].set_title('x-axis errors')
 axs[0].set_xlabel('Error along x-axis (m)')
 axs[0].set_ylabel('x-position of marker (m)')
 axs[1].set_title('y-axis errors')
 axs[1].set_xlabel('Error along y-axis (m)')
 axs[1].set_ylabel('y-position of marker (m)')
-for id, points in results[0].items():
-    points = np.array(points) - gt_pos[id]
+for id in metrics['markers']:
+    points = errors[(calibration == 0) & (marker_ids == id)]
     axs[0].scatter(points[:,0], np.repeat(gt_pos[id][0], points.shape[0]), label=f'Marker {id}')
     axs[1].scatter(points[:,1], np.repeat(gt_pos[id][1], points.shape[0]), label=f'Marker {id}')
+f.savefig(FIGURE_DIR / 'comparison_axis_errors.png', dpi=100)
 
-plt.show()
-
-
-
+print(f'figures written to {FIGURE_DIR}')
+if SHOW:
+    plt.show()
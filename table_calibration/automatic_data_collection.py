@@ -1,6 +1,20 @@
 import robotic as ry
 import numpy as np
-import json
+import itertools
+import sys
+import time
+from pathlib import Path
+from pcl_dataset import open_writer, write_pose, write_plane_summary, write_manifest
+from plane_segmentation import ransac_plane, plane_summary
+
+sys.path.append(str(Path(__file__).parent.parent))
+from common.pose_planner import PosePlanner
+from common.pose_ordering import plan_ordered, travel_time
+from common.ik_cache import IKCache
+from common.reachability import ReachabilityMap, MAP_FILE
+from common.pcl_preprocessing import preprocess
+from common.depth_fusion import DepthFusion
+from common.recording import open_bot
 
 
 NUMBER_OF_POSES = 20
@@ -12,80 +26,125 @@ X_BOUNDS = (-.5, .5)
 Y_BOUNDS = (.1, .5)
 FILTER_PCL_MIN_DISTANCE = 0.2
 FILTER_PCL_MAX_DISTANCE = 0.8
+MAX_POINTS = None # voxel decimate the stored pointclouds to this many points, None keeps all
+SEGMENT_TABLE = True # keep only the RANSAC inliers of the table plane
+FRAMES_PER_POSE = 1 # > 1 fuses this many frames per pose into one denoised cloud with per point depth variance
+FUSION = 'median' # 'median' or 'mean'
 SEED = 0
+ORDER_POSES = True # plan all poses up front and visit them in travel time optimized order
+DATA_FILE = 'camera_calibration_data.h5'
+IK_CACHE_FILE = Path(__file__).parent.parent / 'data' / 'ik_cache.json' # None to disable the cache
+REACHABILITY_FILE = MAP_FILE # built by common/reachability.py, None to disable
 
 
-def look_with_angle(C, target_name, distance, angle):
-    komo = ry.KOMO(C, 1, 1, 0, True)
-    
-    komo.addControlObjective([], 0, 1e-1)
+def sample_target(rng, min_pos, max_pos):
+    pos = rng.random(2) * (max_pos - min_pos) + min_pos
+    angle = rng.random(1)[0] * (MAX_ANGLE - MIN_ANGLE) + MIN_ANGLE
+    distance = rng.random(1)[0] * ( MAX_DISTANCE - MIN_DISTANCE) + MIN_DISTANCE
+    return pos.tolist() + [.6], distance, angle
 
-    height = distance * np.cos(angle)
 
-    komo.addObjective([], ry.FS.accumulatedCollisions, [], ry.OT.eq, [1])
-    komo.addObjective([], ry.FS.negDistance, ['l_cameraWrist', target_name], ry.OT.eq, [1], [-distance]) 
-    komo.addObjective([], ry.FS.jointLimits, [], ry.OT.ineq)
-
-    komo.addObjective([], ry.FS.positionDiff, ['l_cameraWrist', target_name], ry.OT.eq, [0,0,1], [0,0,height])
-    # point camera at target
-    komo.addObjective([], ry.FS.positionRel, [target_name, 'l_cameraWrist'], ry.OT.eq, [[1,0,0],[0,1,0]])
-
-    return komo
+def capture_points(bot, fusion):
+    # filtered pointcloud of the current pose and its per point depth variance (None for a single frame)
+    if FRAMES_PER_POSE > 1:
+        fusion.reset()
+        for _ in range(FRAMES_PER_POSE):
+            fusion.add(bot.getImageDepthPcl("l_cameraWrist")[2])
+        points, variance, _ = fusion.fuse()
+        return preprocess(points, FILTER_PCL_MIN_DISTANCE, FILTER_PCL_MAX_DISTANCE, variance, max_points=MAX_POINTS,
+                          method='voxel')
+    _,_, points = bot.getImageDepthPcl("l_cameraWrist")
+    points = preprocess(points, FILTER_PCL_MIN_DISTANCE, FILTER_PCL_MAX_DISTANCE, max_points=MAX_POINTS, method='voxel')
+    return points, None
 
 
 def main():
     C = ry.Config()
     C.addFile(ry.raiPath("scenarios/pandaSingle_camera.g"))
-    bot = ry.BotOp(C, False)
+    bot = open_bot(C, False)
     bot.getImageAndDepth('l_cameraWrist') # initialize camera
 
     target = C.addFrame('target').setShape(ry.ST.marker, [.1])
 
     rng = np.random.default_rng(SEED)
+    ransac_rng = np.random.default_rng(SEED + 1)
 
-    data = []
+    fusion = DepthFusion(FRAMES_PER_POSE, FUSION)
 
     min_pos = np.array([X_BOUNDS[0], Y_BOUNDS[0]])
     max_pos = np.array([X_BOUNDS[1], Y_BOUNDS[1]])
 
-    i = 0
-
-    while i < NUMBER_OF_POSES:
-        pos = rng.random(2) * (max_pos - min_pos) + min_pos
-        target.setPosition(pos.tolist() + [.6])
-
-        angle = rng.random(1)[0] * (MAX_ANGLE - MIN_ANGLE) + MIN_ANGLE
-        distance = rng.random(1)[0] * ( MAX_DISTANCE - MIN_DISTANCE) + MIN_DISTANCE
+    cache = IKCache(IK_CACHE_FILE) if IK_CACHE_FILE is not None else None
+    reachability = None
+    if REACHABILITY_FILE is not None and Path(REACHABILITY_FILE).is_file():
+        reachability = ReachabilityMap.load(REACHABILITY_FILE)
+    sampler = lambda: sample_target(rng, min_pos, max_pos)
 
-        komo = look_with_angle(C, 'target', distance, angle)
-        ret = ry.NLP_Solver(komo.nlp(), verbose=-1).solve()
-        if not ret.feasible:
-            continue
+    estimated_motion_time = 0
+    motion_time = 0
 
-        path = komo.getPath()
-
-        bot.moveTo(path[-1])
-        bot.wait(C)
-        bot.hold(floating=False)
-
-        _,_, points = bot.getImageDepthPcl("l_cameraWrist")
-        points = points.reshape(-1,3)
-        mask = (np.linalg.norm(points, axis=-1) > FILTER_PCL_MIN_DISTANCE) & (np.linalg.norm(points, axis=-1) < FILTER_PCL_MAX_DISTANCE)
-        data.append({
-            'id': i,
-            'gripper_pose': C.getFrame("l_gripper").getPose().tolist(), 
-            'joint_state':C.getJointState().tolist(),
-            'pointcloud': points[mask].tolist()
-        })
-
-        i += 1
-        
+    i = 0
+    with open_writer(DATA_FILE) as h5:
+        try:
+            with PosePlanner(sampler, cache=cache, reachability=reachability) as planner: # the pool is closed on errors
+                poses = planner
+                if ORDER_POSES:
+                    # poses skipped for lack of a table plane are replaced by further poses of the planner
+                    poses = itertools.chain(plan_ordered(planner, NUMBER_OF_POSES, C.getJointState()), planner)
+
+                for q, (target_position, _, _) in poses:
+                    if i == NUMBER_OF_POSES:
+                        break
+                    target.setPosition(target_position)
+
+                    estimated_motion_time += travel_time(C.getJointState(), q)
+                    start = time.time()
+                    bot.moveTo(q)
+                    bot.wait(C)
+                    motion_time += time.time() - start
+                    bot.hold(floating=False)
+
+                    points, variance = capture_points(bot, fusion)
+                    if SEGMENT_TABLE:
+                        plane = ransac_plane(points, ransac_rng)
+                        if plane is None:
+                            print(f'no table plane found at {target_position}, pose skipped')
+                            continue
+                        points = points[plane[2]]
+                        variance = variance[plane[2]] if variance is not None else None
+                        write_plane_summary(h5, i, *plane_summary(points))
+                    write_pose(h5, i, C.getJointState(), C.getFrame("l_gripper").getPose(), points, variance)
+                    i += 1
+        finally:
+            # the manifest is written with the poses written so far even if planning or the robot failed, so they
+            # stay readable
+            write_manifest(h5, i, {
+                'NUMBER_OF_POSES': NUMBER_OF_POSES,
+                'MIN_ANGLE': MIN_ANGLE,
+                'MAX_ANGLE': MAX_ANGLE,
+                'MIN_DISTANCE': MIN_DISTANCE,
+                'MAX_DISTANCE': MAX_DISTANCE,
+                'X_BOUNDS': X_BOUNDS,
+                'Y_BOUNDS': Y_BOUNDS,
+                'FILTER_PCL_MIN_DISTANCE': FILTER_PCL_MIN_DISTANCE,
+                'FILTER_PCL_MAX_DISTANCE': FILTER_PCL_MAX_DISTANCE,
+                'MAX_POINTS': MAX_POINTS,
+                'SEGMENT_TABLE': SEGMENT_TABLE,
+                'FRAMES_PER_POSE': FRAMES_PER_POSE,
+                'FUSION': FUSION,
+                'SEED': SEED,
+                'ORDER_POSES': ORDER_POSES
+            })
+
+    print(planner.summary())
+    print(f'motion time: estimated {estimated_motion_time:.1f}s, actual {motion_time:.1f}s')
 
     del bot
     del C
 
-    with open("camera_calibration_data.json", "w") as f:
-        json.dump(data, f, indent=2)
+    if cache is not None:
+        cache.save() # after the manifest, the data stays readable if this fails
+        print(cache.summary())
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,156 @@
+# Benchmark of the calibration solvers on synthetic data (synthetic_data.py) with a known camera pose. For every
+# size in SIZES (total number of points, or marker correspondences for the closed form fit) every solver is timed
+# (best of REPEATS, a single run above REPEAT_MAX_POINTS), its peak memory is measured with tracemalloc in a
+# separate run and the error of its pose against the true one is computed. Data generation is not measured, the
+# peak memory is what the solver allocates on top of its input.
+#   lin, lin_d        solve_by_linerization / solve_by_lin_derivative on the grouped layout of load_data
+#   lin_stream        solve_by_normal_equations, streaming the poses as views of the same block
+#   plane             solve_from_plane_summaries, including the plane_summary of every pose
+#   se3               Levenberg-Marquardt of se3_solution.py, including the moments and the linear warm start
+#   closed_form       P = Y^T X (X^T X)^-1 of old solution/calibration_optimize.py on marker correspondences
+# The linear solutions are projected to SE(3) before their error is computed. Solvers that build (N, 12) matrices
+# are skipped above their MAX_POINTS. The results are written to RESULTS_FILE, if BASELINE_FILE exists the
+# results are compared against it and slowdowns or less accurate poses are reported as regressions.
+
+import json
+import time
+import tracemalloc
+import numpy as np
+from pathlib import Path
+from linearized_solution import solve_by_linerization, solve_by_lin_derivative, solve_by_normal_equations, \
+    solve_from_plane_summaries, solve_from_moments, homogeneous_moments, split_poses
+from plane_segmentation import plane_summary
+from se3_solution import project_to_se3, solve_se3
+from synthetic_data import table_dataset, marker_dataset, pose_error
+
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000, 50_000_000]
+N_POSES = 20
+SOLVERS = ['lin', 'lin_d', 'lin_stream', 'plane', 'se3', 'closed_form']
+MAX_POINTS = {'lin': 2_000_000, 'closed_form': 10_000_000} # None or missing for no limit
+REPEATS = 3
+REPEAT_MAX_POINTS = 1_000_000
+SEED = 0
+RESULTS_FILE = Path(__file__).parent.parent / 'data' / 'benchmarks' / 'solvers_latest.json'
+BASELINE_FILE = Path(__file__).parent.parent / 'data' / 'benchmarks' / 'solvers_baseline.json'
+REGRESSION_FACTOR = 1.5 # time or memory above this factor of the baseline is a regression
+REGRESSION_MIN_TIME = 0.01 # s, slowdowns smaller than this are timing noise
+REGRESSION_MIN_MEMORY = 2**20 # bytes, increases smaller than this are ignored
+ERROR_TOLERANCE = (0.01, 0.0005) # rotation (deg) and translation (m) errors may grow by this much
+
+
+def closed_form_fit(X, Y):
+    # least squares P with Y = [X | 1] P^T, as in old solution/calibration_optimize.py
+    X = np.hstack([X, np.ones((X.shape[0], 1))])
+    return Y.T @ X @ np.linalg.inv(X.T @ X)
+
+
+def se3_from_points(n, c, points, offsets):
+    M = np.array([homogeneous_moments(p) for p in split_poses(points, offsets)])
+    R, t = project_to_se3(solve_from_moments(zip(n, c, M)))
+    R, t, _ = solve_se3(n, c, M, R, t)
+    return np.hstack([R, t[:, None]])
+
+
+def solver_function(name):
+    # solver taking the dataset of its kind and returning P = [R | t] (camera in gripper)
+    if name == 'lin':
+        return lambda n, c, points, offsets: solve_by_linerization(n, c, points, offsets)
+    if name == 'lin_d':
+        return lambda n, c, points, offsets: solve_by_lin_derivative(n, c, points, offsets)
+    if name == 'lin_stream':
+        return lambda n, c, points, offsets: solve_by_normal_equations(zip(n, c, split_poses(points, offsets)))
+    if name == 'plane':
+        return lambda n, c, points, offsets: solve_from_plane_summaries(
+            (n_j, c_j, *plane_summary(p)) for n_j, c_j, p in zip(n, c, split_poses(points, offsets)))
+    if name == 'se3':
+        return se3_from_points
+    if name == 'closed_form':
+        return closed_form_fit
+    raise ValueError("Invalid SOLVER option")
+
+
+def measure(solver, data, repeats):
+    # best time of repeats runs, peak memory of one traced run and the pose of the traced run
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        solver(*data)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    P = solver(*data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak, P
+
+
+def run(sizes=SIZES, solvers=SOLVERS, n_poses=N_POSES, seed=SEED):
+    results = []
+    for size in sizes:
+        rng = np.random.default_rng(seed)
+        table = table_dataset(rng, n_poses, size) if any(s != 'closed_form' for s in solvers) else None
+        markers = marker_dataset(rng, n_poses, size) if 'closed_form' in solvers else None
+        repeats = REPEATS if size <= REPEAT_MAX_POINTS else 1
+        for name in solvers:
+            result = {'solver': name, 'size': size}
+            if MAX_POINTS.get(name) is not None and size > MAX_POINTS[name]:
+                result['skipped'] = True
+            else:
+                duration, peak, P = measure(solver_function(name), markers if name == 'closed_form' else table,
+                                            repeats)
+                rotation_error, translation_error = pose_error(*project_to_se3(P))
+                result.update(time=duration, peak_memory=peak, rotation_error=float(rotation_error),
+                              translation_error=float(translation_error))
+            print(format_result(result), flush=True)
+            results.append(result)
+        del table, markers
+    return results
+
+
+def format_result(result):
+    if result.get('skipped'):
+        return f"{result['solver']:12s} {result['size']:>11,d} skipped"
+    return (f"{result['solver']:12s} {result['size']:>11,d} {result['time'] * 1e3:10.1f}ms "
+            f"{result['peak_memory'] / 2**20:10.1f}MB  rotation error {result['rotation_error']:.4f}deg, "
+            f"translation error {result['translation_error'] * 1e3:.3f}mm")
+
+
+def regressions(results, baseline):
+    # descriptions of all results that are slower, use more memory or are less accurate than the baseline
+    reference = {(r['solver'], r['size']): r for r in baseline if not r.get('skipped')}
+    found = []
+    for result in results:
+        base = reference.get((result['solver'], result['size']))
+        if base is None or result.get('skipped'):
+            continue
+        name = f"{result['solver']} at {result['size']:,d} points"
+        if result['time'] > REGRESSION_FACTOR * base['time'] and result['time'] - base['time'] > REGRESSION_MIN_TIME:
+            found.append(f"{name}: {result['time'] * 1e3:.1f}ms, baseline {base['time'] * 1e3:.1f}ms")
+        if result['peak_memory'] > REGRESSION_FACTOR * base['peak_memory'] and \
+                result['peak_memory'] - base['peak_memory'] > REGRESSION_MIN_MEMORY:
+            found.append(f"{name}: {result['peak_memory'] / 2**20:.1f}MB, baseline {base['peak_memory'] / 2**20:.1f}MB")
+        if result['rotation_error'] > base['rotation_error'] + ERROR_TOLERANCE[0] or \
+                result['translation_error'] > base['translation_error'] + ERROR_TOLERANCE[1]:
+            found.append(f"{name}: error {result['rotation_error']:.4f}deg / {result['translation_error'] * 1e3:.3f}mm, "
+                         f"baseline {base['rotation_error']:.4f}deg / {base['translation_error'] * 1e3:.3f}mm")
+    return found
+
+
+def main():
+    print(f"{'solver':12s} {'points':>11s} {'time':>12s} {'peak memory':>12s}")
+    results = run()
+    RESULTS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(RESULTS_FILE, 'w') as f:
+        json.dump(results, f, indent=2)
+    if BASELINE_FILE.is_file():
+        with open(BASELINE_FILE, 'r') as f:
+            found = regressions(results, json.load(f))
+        print(f'{len(found)} regressions against {BASELINE_FILE.name}')
+        for line in found:
+            print(f'  {line}')
+    else:
+        print(f'no baseline, copy {RESULTS_FILE.name} to {BASELINE_FILE.name} to compare future runs against it')
+
+
+if __name__ == '__main__':
+    main()
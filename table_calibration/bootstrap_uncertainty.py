@@ -0,0 +1,113 @@
+# Uncertainty of the table calibration by re-solving it on resampled pose subsets. Every pose enters the solvers
+# only through its table normal n, center c and the 4x4 moment matrix M of its points (see se3_solution.py), so the
+# pointclouds are reduced once and the workers of the pool only receive these (poses, 4, 4) arrays at startup.
+# A resample is a list of pose indices, either drawn with replacement (bootstrap) or all poses but LEAVE_OUT random
+# ones (leave-k-out). Reported are percentile intervals per axis of the translation and of the rotation relative to
+# the solution on all poses, and the wall time of the pool compared to solving serially together with the largest
+# difference between the serial and pool solutions.
+
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import robotic as ry
+from scipy.spatial.transform import Rotation
+from linearized_solution import DATA_FILE, iterate_poses, iterate_plane_summaries, homogeneous_moments, \
+    summary_moments, solve_from_moments
+from se3_solution import project_to_se3, solve_se3
+
+
+SOURCE = 'points' # 'points' to use the full pointclouds, 'plane' to use the per pose plane summaries
+MODE = 'bootstrap' # 'bootstrap' to draw the poses with replacement, 'leave_out' to drop LEAVE_OUT poses
+SOLVER = 'se3' # 'se3' for Levenberg-Marquardt on SE(3), 'linear' for the projected linear solution
+N_RESAMPLES = 500
+LEAVE_OUT = 2
+CONFIDENCE = 0.95
+N_WORKERS = None # None for all but one core
+SEED = 0
+
+
+_poses = None
+
+
+def _init_worker(n, c, M):
+    global _poses
+    _poses = (n, c, M)
+
+
+def solve_subset(n, c, M, solver=SOLVER):
+    # (R, t) of the camera in the gripper frame from the given poses
+    R, t = project_to_se3(solve_from_moments(zip(n, c, M)))
+    if solver == 'se3':
+        R, t, _ = solve_se3(n, c, M, R, t)
+    elif solver != 'linear':
+        raise ValueError("Invalid SOLVER option")
+    return R, t
+
+
+def _solve(indices):
+    n, c, M = _poses
+    R, t = solve_subset(n[indices], c[indices], M[indices])
+    return R, t
+
+
+def resamples(n_poses, rng, mode=MODE, n_resamples=N_RESAMPLES, leave_out=LEAVE_OUT):
+    if mode == 'bootstrap':
+        return [rng.integers(0, n_poses, n_poses) for _ in range(n_resamples)]
+    if mode == 'leave_out':
+        return [np.sort(rng.permutation(n_poses)[leave_out:]) for _ in range(n_resamples)]
+    raise ValueError("Invalid MODE option")
+
+
+def intervals(R_ref, solutions, confidence=CONFIDENCE):
+    # percentile intervals of t (m) and of the rotation relative to R_ref as rotation vector (deg), each (2, 3)
+    t = np.array([t for _, t in solutions])
+    rotvec = Rotation.from_matrix(np.array([R for R, _ in solutions]) @ R_ref.T).as_rotvec(degrees=True)
+    q = 100 * np.array([(1 - confidence) / 2, (1 + confidence) / 2])
+    return np.percentile(t, q, axis=0), np.percentile(rotvec, q, axis=0)
+
+
+def main():
+    C = ry.Config()
+    C.addFile(ry.raiPath("scenarios/pandaSingle_camera.g"))
+
+    if SOURCE == 'points':
+        poses = [(n, c, homogeneous_moments(points)) for n, c, points in iterate_poses(C, DATA_FILE)]
+    elif SOURCE == 'plane':
+        poses = [(n, c, summary_moments(m, S, k)) for n, c, m, S, k in iterate_plane_summaries(C, DATA_FILE)]
+    else:
+        raise ValueError("Invalid SOURCE option")
+    n = np.array([pose[0] for pose in poses])
+    c = np.array([pose[1] for pose in poses])
+    M = np.array([pose[2] for pose in poses])
+
+    R_ref, t_ref = solve_subset(n, c, M)
+    subsets = resamples(n.shape[0], np.random.default_rng(SEED))
+    print(f'{len(subsets)} {MODE} resamples of {n.shape[0]} poses, solver {SOLVER}')
+
+    start = time.perf_counter()
+    _init_worker(n, c, M)
+    serial = [_solve(indices) for indices in subsets]
+    serial_time = time.perf_counter() - start
+
+    n_workers = N_WORKERS or max(1, (os.cpu_count() or 2) - 1)
+    start = time.perf_counter()
+    with mp.get_context('spawn').Pool(n_workers, initializer=_init_worker, initargs=(n, c, M)) as pool:
+        solutions = pool.map(_solve, subsets, chunksize=max(1, len(subsets) // (4 * n_workers)))
+    pool_time = time.perf_counter() - start
+
+    t_interval, r_interval = intervals(R_ref, solutions)
+    print(f'translation {np.round(t_ref, 5).tolist()}')
+    for axis, (low, high) in zip('xyz', t_interval.T):
+        print(f'  t_{axis}: [{low * 1e3:+.2f}, {high * 1e3:+.2f}]mm ({CONFIDENCE:.0%} interval)')
+    for axis, (low, high) in zip('xyz', r_interval.T):
+        print(f'  rotation about {axis}: [{low:+.3f}, {high:+.3f}]deg relative to the full solution')
+    print(f'serial {serial_time:.2f}s, pool of {n_workers} workers {pool_time:.2f}s (incl. startup), '
+          f'speedup {serial_time / pool_time:.1f}x')
+    # the pool solves the same problems, its translations should match the serial ones up to rounding
+    deviation = max(np.abs(t_s - t_p).max() for (_, t_s), (_, t_p) in zip(serial, solutions))
+    print(f'max translation difference serial / pool {deviation * 1e3:.2g}mm')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+# One-shot conversion of the old json datasets (list of dicts with id, gripper_pose, joint_state and pointcloud)
+# into the binary format of pcl_dataset.py. Usage: python convert_json_data.py [input.json] [output.h5]
+
+import json
+import sys
+from pathlib import Path
+from pcl_dataset import open_writer, write_pose, write_manifest
+
+
+def convert(json_file, h5_file):
+    with open(json_file, "r") as f:
+        data = json.load(f)
+
+    with open_writer(h5_file) as h5:
+        for i, entry in enumerate(data):
+            write_pose(h5, i, entry['joint_state'], entry['gripper_pose'], entry['pointcloud'])
+        write_manifest(h5, len(data), {'converted_from': str(json_file)})
+    print(f'converted {len(data)} poses from {json_file} to {h5_file}')
+
+
+if __name__ == '__main__':
+    json_file = Path(sys.argv[1]) if len(sys.argv) > 1 else Path('camera_calibration_data.json')
+    h5_file = Path(sys.argv[2]) if len(sys.argv) > 2 else json_file.with_suffix('.h5')
+    convert(json_file, h5_file)
@@ -1,78 +1,172 @@
 # we parse our data into the form (n_i, c_i, x_i), where n_i is the normal of the table and c_i its center expressed in the gripper frame, while
-# x_i is a point of the pointcloud in the the camera frame in homogeneous coordinates. We try to find the projection P from camera to gripper
+# x_i is a point of the pointcloud in the the camera frame in homogeneous coordinates. Since n_i and c_i only change between poses,
+# load_data stores them once per pose together with a contiguous block of all points and the offsets of each pose within it. We try to find the projection P from camera to gripper
 # such that all points lie on the table, ie n_i^T * (P * x_i - c_i) = 0 for all i. We will try to solve this by linearization either of the 
 # problem itself or of the by rewriting the derivate as a linear problem (see respective functions below). Both yield similar but incorrect results.
 # The error is therefore likely in my problem-formulation, in the data or due to some degeneracy.
 # The resulting P is a 3x4 matrix that combines a rotation R and translation t in the form P = [R | t],
 # from which we first recover R and t and then our transformation Q = [t, q] where q is the quaternion describing R.
 
-import json
 import numpy as np
 import robotic as ry
+import sys
+from pathlib import Path
 from scipy.spatial.transform import Rotation
+from pcl_dataset import read_poses, read_joint_states
+from plane_segmentation import ransac_plane, plane_summary
 
+sys.path.append(str(Path(__file__).parent.parent))
+from common.kinematics_cache import KinematicsCache, cache_file
 
-SOLVER = 'lin_d' # 'lin' for linearization, 'lin_d' for linearization by derivative
 
+SOLVER = 'lin_d' # 'lin' for linearization, 'lin_d' for linearization by derivative, 'lin_stream' for streamed normal equations,
+                 # 'plane' for the normal equations from per pose plane summaries
+DATA_FILE = 'camera_calibration_data.h5'
+CHUNK_SIZE = 100_000 # points per block when accumulating the normal equations
+
+
+def table_in_gripper(C, filename):
+    # normal n (the global z vector) and center c of the table in the gripper frame for all poses,
+    # from the cached forward kinematics of the recorded joint states
+    fk = KinematicsCache(C, read_joint_states(filename), cache_file(filename))
+    n = fk.get('l_gripper')[:, 2, :3] # R^T e_z
+    c = fk.relative('origin', to='l_gripper')[:, :3, 3]
+    return n, c
 
-def load_data(C, filename):
-    with open(filename, "r") as f:
-        data = json.load(f)
 
-    n_all = []
-    c_all = []
-    x_all = []
+def load_data(C, filename):
+    # Grouped layout: n, c and the joint state are stored once per pose, the points of all poses in one
+    # contiguous (N, 3) float32 block where pose j owns points[offsets[j]:offsets[j+1]].
+    n, c = table_in_gripper(C, filename)
     pcls = []
     qs = []
 
-    for entry in data:
-        C.setJointState(entry['joint_state'])
-        c, _ = C.eval(ry.FS.positionRel, ['origin', 'l_gripper'])
-        n, _ = C.eval(ry.FS.vectorZRel, ['world','l_gripper']) # the table normal is the global z vector
+    for entry in read_poses(filename):
+        pcls.append(entry['pointcloud'])
+        qs.append(entry['joint_state'])
+
+    offsets = np.concatenate([[0], np.cumsum([pcl.shape[0] for pcl in pcls])])
+    points = np.concatenate(pcls).astype(np.float32, copy=False)
+
+    return n, c, points, offsets, np.array(qs)
+
+
+def split_poses(points, offsets):
+    # views on the points of each pose, no copies
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        yield points[start:end]
+
+
+def iterate_poses(C, filename):
+    # yields (n, c, points) for one pose at a time, nothing is repeated or stacked
+    n, c = table_in_gripper(C, filename)
+    for j, entry in enumerate(read_poses(filename)):
+        yield n[j], c[j], entry['pointcloud']
+
+
+def iterate_plane_summaries(C, filename, seed=0):
+    # yields (n, c, centroid, covariance, count) per pose, using the stored summary if the table was already
+    # segmented during collection (its pointcloud is not read) and running RANSAC on the stored pointcloud otherwise.
+    # Poses without a table plane are skipped.
+    rng = np.random.default_rng(seed)
+    n, c = table_in_gripper(C, filename)
+    for j, entry in enumerate(read_poses(filename, skip_summarized=True)):
+        summary = entry['plane_summary']
+        if summary is None:
+            points = entry['pointcloud']
+            plane = ransac_plane(points, rng)
+            if plane is None:
+                print(f'no table plane in pose {j}, skipped')
+                continue
+            summary = plane_summary(points[plane[2]])
+        yield n[j], c[j], *summary
+
+
+def homogeneous_moments(points, chunk_size=CHUNK_SIZE):
+    # computes X^T X for the homogeneous points X = [points | 1] block by block without building X
+    M = np.zeros((4, 4))
+    for start in range(0, points.shape[0], chunk_size):
+        block = points[start:start + chunk_size].astype(np.float64)
+        M[:3, :3] += block.T @ block
+        M[:3, 3] += block.sum(axis=0)
+    M[3, :3] = M[:3, 3]
+    M[3, 3] = points.shape[0]
+    return M
+
+
+def summary_moments(centroid, covariance, count):
+    # X^T X of the homogeneous points recovered from their centroid m, covariance S and count k:
+    # sum p p^T = k (S + m m^T), sum p = k m
+    M = np.empty((4, 4))
+    M[:3, :3] = count * (covariance + np.outer(centroid, centroid))
+    M[:3, 3] = M[3, :3] = count * centroid
+    M[3, 3] = count
+    return M
+
+
+def solve_from_moments(poses):
+    # Same least squares problem as solve_by_linerization, but we only accumulate A^T A (12x12) and A^T b (12).
+    # As n and c are constant within a pose, its rows kron(n, x_i) contribute kron(n n^T, M) to A^T A and
+    # (n^T c) kron(n, M[3]) to A^T b, where M = X^T X of the homogeneous points X of the pose.
+    # Note that A^T A vec(P) = A^T b is also exactly the stationarity condition solve_by_lin_derivative starts from.
+    AtA = np.zeros((12, 12))
+    Atb = np.zeros(12)
+    for n, c, M in poses:
+        AtA += np.kron(np.outer(n, n), M)
+        Atb += (n @ c) * np.kron(n, M[3])
+    P,_,_,_ = np.linalg.lstsq(AtA, Atb, rcond=None)
+    return P.reshape(3,4)
 
-        points = np.array(entry['pointcloud'])
-        ones = np.ones((points.shape[0], 1))
-        points_hom = np.hstack([points, ones])  # convert to homogeneous coordinates
 
-        n_all.append(np.repeat(n[None, :], points.shape[0], axis=0))
-        c_all.append(np.repeat(c[None, :], points.shape[0], axis=0))
-        x_all.append(points_hom)
-        pcls.append(points)
-        qs.append(entry['joint_state'])
+def solve_by_normal_equations(poses):
+    # streams (n, c, points) per pose, memory stays constant in the number of points
+    return solve_from_moments((n, c, homogeneous_moments(points)) for n, c, points in poses)
+
+
+def solve_from_plane_summaries(summaries):
+    # streams (n, c, centroid, covariance, count) per pose, independent of the number of points
+    return solve_from_moments((n, c, summary_moments(m, S, k)) for n, c, m, S, k in summaries)
 
-    n_all = np.vstack(n_all)
-    c_all = np.vstack(c_all)
-    x_all = np.vstack(x_all)
 
-    return n_all, c_all, x_all, pcls, qs
+def kronecker_rows(n, points, offsets):
+    # builds the rows kron(n_i, x_i) for the homogeneous points x_i = (p_i, 1), filling one pose block at a time
+    A = np.empty((points.shape[0], 3, 4))
+    for j, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        A[start:end, :, :3] = n[j][None, :, None] * points[start:end, None, :]
+        A[start:end, :, 3] = n[j]
+    return A.reshape(-1, 12)
 
 
-def solve_by_linerization(n, c, x):
+def solve_by_linerization(n, c, points, offsets):
     # We rewrite the problem as n_i^T * c_i = n_i^T * P * x_i = kron(n_i, x_i) * vec(P), 
     # which allows us to solve for vec(P) with least squares.
-    A = np.einsum('ij,ik->ijk', n, x).reshape(-1, 12) # each row is kron(n_i, x_i)
-    b = np.einsum('ij,ij->i', n, c) # each row is n_i^T * c_i
+    A = kronecker_rows(n, points, offsets) # each row is kron(n_i, x_i)
+    b = np.repeat(np.einsum('ij,ij->i', n, c), np.diff(offsets)) # each row is n_i^T * c_i
     P,_,_,_ = np.linalg.lstsq(A, b)
     return P.reshape(3,4)
 
 
-def solve_by_lin_derivative(n, c, x):
+def solve_by_lin_derivative(n, c, points, offsets):
     # we attempt to find a closed form solution by deriving ||n_i^T * (P * x_i - c_i)||^2 wrt P.
     # This leads to the equation sum_i (n_i^T P x_i) (n_i x_i^T) = sum_i (n_i^T c_i) n_i x_i^T = A
     # Let S = [vec(n_i x_i^T)]_i be the matrix with rows vec(n_i x_i^T) and solve for s in S s = vec(A)
     # Now we recover P by S vec(P) = s. This leads to the closed form vec(P) = S(S^T S)^-1 S^-1 vec(A)
-    A = np.einsum('ij, ij, ik, il->kl', n, c, n, x)
-    S = np.einsum('ij, ik->ijk', n, x).reshape(-1, 12)
-    s,_,_,_ = np.linalg.lstsq(S.T, A.ravel(), rcond=None)
-    P,_,_,_ = np.linalg.lstsq(S, s, rcond=None)
+    # n and c are constant per pose, so A only needs the per pose sums of the homogeneous points (empty poses sum to 0).
+    # For S of full column rank both least squares steps together give S^T S vec(P) = vec(A), and S^T S is summed
+    # per pose from X^T X as in solve_from_moments, so the (N, 12) matrix S is never built.
+    x_sums = np.array([np.append(p.sum(axis=0, dtype=np.float64), p.shape[0]) for p in split_poses(points, offsets)])
+    A = np.einsum('ij, ij, ik, il->kl', n, c, n, x_sums)
+    StS = sum(np.kron(np.outer(n_j, n_j), homogeneous_moments(p)) for n_j, p in zip(n, split_poses(points, offsets)))
+    P,_,_,_ = np.linalg.lstsq(StS, A.ravel(), rcond=None)
     return P.reshape(3,4)
 
 
 def get_Q(P):
-    R = P[:3, :3].T
-    t = -R @ P[:3, 3]
+    # P = [R | t] maps camera to gripper coordinates, so it is the camera pose in the gripper frame. Q is the rai pose
+    # [x, y, z, qw, qx, qy, qz] as in the cameraWrist Q of the g-file (scipy quaternions are scalar last).
+    R, t = P[:3, :3], P[:3, 3]
     q = Rotation.from_matrix(R).as_quat()
-    Q = np.round(t, 8).tolist() + np.round(q, 8).tolist()
+    Q = np.round(t, 8).tolist() + np.round(np.roll(q, 1), 8).tolist()
     return Q
 
 
@@ -91,19 +185,27 @@ def main():
     C = ry.Config()
     C.addFile(ry.raiPath("scenarios/pandaSingle_camera.g"))
     
-    n, c, x, pcls, qs = load_data(C, 'camera_calibration_data.json')
-    if SOLVER == 'lin':
-        P = solve_by_linerization(n, c, x)
-    elif SOLVER == 'lin_d':
-        P = solve_by_lin_derivative(n, c, x)
+    if SOLVER in ['lin_stream', 'plane']:
+        if SOLVER == 'lin_stream':
+            P = solve_by_normal_equations(iterate_poses(C, DATA_FILE))
+        else:
+            P = solve_from_plane_summaries(iterate_plane_summaries(C, DATA_FILE))
+        # only read back pose by pose for the visualization
+        pcls = (entry['pointcloud'] for entry in read_poses(DATA_FILE))
+        qs = (entry['joint_state'] for entry in read_poses(DATA_FILE))
     else:
-        raise ValueError("Invalid SOLVER option")
+        n, c, points, offsets, qs = load_data(C, DATA_FILE)
+        pcls = split_poses(points, offsets)
+        if SOLVER == 'lin':
+            P = solve_by_linerization(n, c, points, offsets)
+        elif SOLVER == 'lin_d':
+            P = solve_by_lin_derivative(n, c, points, offsets)
+        else:
+            raise ValueError("Invalid SOLVER option")
     # both methods produce different, incorrect results
 
     Q = get_Q(P)
-    print(Q) # returns [0.02063466, 0.05156388, 0.03764117, 0.00366712, 0.99988991, -0.00660188, 0.0127722] for lin
-    # TODO: weirdly mostly correct, but the y translation is in the wrong direction and the rotation should 
-    # align y instead of x axis with the gripper.
+    print(Q) # camera in the gripper frame, can be pasted as cameraWrist Q
 
     visualize_Q(C, Q, pcls, qs)
 
@@ -1,44 +1,69 @@
 import robotic as ry
 import numpy as np
-import json
+from robotic.src import h5_helper
+from pcl_dataset import write_pose, write_plane_summary, write_manifest, close
+from plane_segmentation import ransac_plane, plane_summary
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from common.camera_capture import CameraCapture, SerializedBot
+from common.pcl_preprocessing import preprocess
+from common.recording import open_bot
 
 NUMBER_OF_POSES = 20
 MIN_DISTANCE = 0.2
 MAX_DISTANCE = 0.8
+PREVIEW_MAX_POINTS = 50_000 # the preview pointcloud is decimated to this many points
+MAX_POINTS = None # voxel decimate the stored pointclouds to this many points, None keeps all
+SEGMENT_TABLE = True # keep only the RANSAC inliers of the table plane
+DATA_FILE = 'camera_calibration_data.h5'
 
 C = ry.Config()
 C.addFile(ry.raiPath("scenarios/pandaSingle_camera.g"))
-bot = ry.BotOp(C, True)
+bot = SerializedBot(open_bot(C, True)) # shared with the capture thread
 pcl = C.addFrame("pcl", "l_cameraWrist")
 bot.getImageAndDepth('l_cameraWrist') # initialize camera
 
-data = []
+h5 = h5_helper.H5Writer(DATA_FILE)
+ransac_rng = np.random.default_rng(0) # fixed seed, so RANSAC is reproducible
+camera = CameraCapture(bot, 'l_cameraWrist').start() # preview frames, processed at camera rate
 
-for i in range(NUMBER_OF_POSES):
+i = 0
+while i < NUMBER_OF_POSES:
     bot.hold(floating=True, damping=False)
+    last_frame = -1
     while bot.getKeyPressed() != ord('q'):
-        rgb, _, points = bot.getImageDepthPcl("l_cameraWrist")
-        points = points.reshape(-1,3)
-        rgb = rgb.reshape(-1,3)
-        mask = (np.linalg.norm(points, axis=-1) > MIN_DISTANCE) & (np.linalg.norm(points, axis=-1) < MAX_DISTANCE)
-        pcl.setPointCloud(points[mask], rgb[mask])
+        frame = camera.latest()
+        if frame is not None and frame.index != last_frame:
+            last_frame = frame.index
+            pcl.setPointCloud(*preprocess(frame.points, MIN_DISTANCE, MAX_DISTANCE, frame.rgb, PREVIEW_MAX_POINTS))
         bot.sync(C, viewMsg="move to a new pose and press 'q' to capture")
     
     bot.hold(floating=False)
     bot.sync(C)
-    _,_, points = bot.getImageDepthPcl("l_cameraWrist")
-    points = points.reshape(-1,3)
-    mask = (np.linalg.norm(points, axis=-1) > MIN_DISTANCE) & (np.linalg.norm(points, axis=-1) < MAX_DISTANCE)
-    data.append({
-        'id': i,
-        'gripper_pose': C.getFrame("l_gripper").getPose().tolist(), 
-        'joint_state':C.getJointState().tolist(),
-        'pointcloud': points[mask].tolist()
-    })
+    points = camera.next_frame().points # captured after the sync, so it matches the joint state written below
+    points = preprocess(points, MIN_DISTANCE, MAX_DISTANCE, max_points=MAX_POINTS, method='voxel')
+    if SEGMENT_TABLE:
+        plane = ransac_plane(points, ransac_rng)
+        if plane is None:
+            print('no table plane found, retake the pose')
+            continue
+        points = points[plane[2]]
+        write_plane_summary(h5, i, *plane_summary(points))
+    write_pose(h5, i, C.getJointState(), C.getFrame("l_gripper").getPose(), points)
+    i += 1
     
 
+camera.stop()
 del bot
 del C
 
-with open("camera_calibration_data.json", "w") as f:
-    json.dump(data, f, indent=2)
\ No newline at end of file
+write_manifest(h5, NUMBER_OF_POSES, {
+    'NUMBER_OF_POSES': NUMBER_OF_POSES,
+    'MIN_DISTANCE': MIN_DISTANCE,
+    'MAX_DISTANCE': MAX_DISTANCE,
+    'MAX_POINTS': MAX_POINTS,
+    'SEGMENT_TABLE': SEGMENT_TABLE
+})
+close(h5)
\ No newline at end of file
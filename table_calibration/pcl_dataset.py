@@ -0,0 +1,95 @@
+# Binary storage for the table calibration data. Every pose is a group dataset_[i] in an h5 file holding the
+# joint state, the gripper pose and the filtered pointcloud (camera frame) as a compressed float32 (n, 3) array.
+# If the table was segmented during collection, the pointcloud only contains the inliers and their plane summary
+# (centroid, covariance and count, see plane_segmentation.py) is stored in dataset_[i]/plane_*. If several frames
+# were fused per pose (see common/depth_fusion.py), dataset_[i]/pointcloud_variance holds the depth variance per point.
+# Compared to the old json files this is much smaller and poses can be read one at a time without
+# parsing (or even loading) the rest of the file.
+# h5_helper has no close of its own, files are opened with open_reader / open_writer or closed with close.
+
+import json
+import numpy as np
+from contextlib import contextmanager
+from robotic.src import h5_helper
+
+
+def close(h5):
+    # the h5py file of an H5Reader / H5Writer
+    h5.fil.close()
+
+
+@contextmanager
+def open_reader(filename):
+    h5 = h5_helper.H5Reader(filename)
+    try:
+        yield h5
+    finally:
+        close(h5)
+
+
+@contextmanager
+def open_writer(filename):
+    h5 = h5_helper.H5Writer(filename)
+    try:
+        yield h5
+    finally:
+        close(h5)
+
+
+def write_pose(h5, i, joint_state, gripper_pose, points, variance=None):
+    key = f'dataset_{i}'
+    h5.write(key + '/joint_state', joint_state, dtype='float64')
+    h5.write(key + '/gripper_pose', gripper_pose, dtype='float64')
+    # chunked and compressed, h5 decompresses only the chunks of the pose we actually read
+    h5.fil.create_dataset(key + '/pointcloud', data=np.asarray(points, dtype=np.float32).reshape(-1, 3),
+                          chunks=True, compression='gzip', shuffle=True)
+    if variance is not None:
+        h5.fil.create_dataset(key + '/pointcloud_variance', data=np.asarray(variance, dtype=np.float32).ravel(),
+                              chunks=True, compression='gzip', shuffle=True)
+
+
+def write_plane_summary(h5, i, centroid, covariance, count):
+    key = f'dataset_{i}'
+    h5.write(key + '/plane_centroid', centroid, dtype='float64')
+    h5.write(key + '/plane_covariance', covariance, dtype='float64')
+    h5.write(key + '/plane_count', count, dtype='int64')
+
+
+def write_manifest(h5, n_datasets, parameters):
+    manifest = {
+        'description': 'for various poses: joint state and gripper pose of the panda and the filtered pointcloud of the wrist camera in camera coordinates. The parameters entry contains the parameters used for data collection.',
+        'n_datasets': n_datasets,
+        'keys': ['manifest', 'dataset_[i]/joint_state', 'dataset_[i]/gripper_pose', 'dataset_[i]/pointcloud',
+                 'dataset_[i]/pointcloud_variance (optional)', 'dataset_[i]/plane_centroid (optional)', 'dataset_[i]/plane_covariance (optional)', 'dataset_[i]/plane_count (optional)'],
+        'parameters': parameters
+    }
+    h5.write('manifest', bytearray(json.dumps(manifest), 'utf-8'), dtype='int8')
+
+
+def read_poses(filename, skip_summarized=False):
+    # yields one pose at a time, so only a single pointcloud has to be in memory. With skip_summarized the
+    # pointcloud and variance of poses with a plane summary are not read (None), nothing is decompressed for them.
+    # The file is closed once all poses were read or the generator is closed.
+    with open_reader(filename) as h5:
+        manifest = h5.read_dict('manifest')
+        for i in range(manifest['n_datasets']):
+            key = f'dataset_{i}'
+            plane_summary = None
+            if key + '/plane_count' in h5.fil:
+                plane_summary = (h5.read(key + '/plane_centroid'), h5.read(key + '/plane_covariance'), int(h5.read(key + '/plane_count')))
+            points = not (skip_summarized and plane_summary is not None)
+            yield {
+                'id': i,
+                'joint_state': h5.read(key + '/joint_state'),
+                'gripper_pose': h5.read(key + '/gripper_pose'),
+                'pointcloud': h5.read(key + '/pointcloud') if points else None,
+                'variance': h5.read(key + '/pointcloud_variance') if points and key + '/pointcloud_variance' in h5.fil else None,
+                'plane_summary': plane_summary
+            }
+
+
+def read_joint_states(filename):
+    # (n, q) joint states of all poses, without touching the pointclouds
+    with open_reader(filename) as h5:
+        manifest = h5.read_dict('manifest')
+        return np.array([h5.read(f'dataset_{i}/joint_state') for i in range(manifest['n_datasets'])])
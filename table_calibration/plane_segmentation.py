@@ -0,0 +1,66 @@
+# Segments the table from a pointcloud with RANSAC. All hypotheses are scored at once: we sample 3 points for
+# each hypothesis, compute the plane normals with one cross product and evaluate the point-to-plane distances of
+# a random subset of the cloud as a single (points x hypotheses) matrix. The best plane is refined by a least
+# squares fit on its inliers, which are then selected from the full cloud. If no plane can be fitted (fewer than 3
+# points, only degenerate samples or too few inliers) ransac_plane returns None, the collectors then skip the pose.
+# plane_summary reduces the inliers to their centroid, covariance and count, which is all linearized_solution
+# needs to set up the normal equations of a pose.
+
+import numpy as np
+
+
+RANSAC_HYPOTHESES = 256
+RANSAC_THRESHOLD = 0.005 # max point to plane distance of an inlier in m
+RANSAC_EVAL_POINTS = 4096 # number of points used to score the hypotheses
+RANSAC_BATCH_SIZE = 64 # hypotheses scored per matrix product, bounds the memory to EVAL_POINTS x BATCH_SIZE
+
+
+def fit_plane(points):
+    # least squares plane through points, the normal is the direction of least variance
+    centroid = points.mean(axis=0)
+    _, _, Vt = np.linalg.svd(points - centroid, full_matrices=False)
+    normal = Vt[2]
+    return normal, -normal @ centroid
+
+
+def ransac_plane(points, rng, n_hypotheses=RANSAC_HYPOTHESES, threshold=RANSAC_THRESHOLD,
+                 n_eval=RANSAC_EVAL_POINTS, batch_size=RANSAC_BATCH_SIZE):
+    # returns the normal and offset of the plane n^T p + d = 0 and the inlier mask over all points, None if no
+    # plane was found
+    points = np.asarray(points, dtype=np.float64)
+    if points.shape[0] < 3:
+        return None
+
+    samples = points[rng.integers(0, points.shape[0], size=(n_hypotheses, 3))]
+    normals = np.cross(samples[:, 1] - samples[:, 0], samples[:, 2] - samples[:, 0])
+    norms = np.linalg.norm(normals, axis=-1)
+    valid = norms > 1e-9 # drop collinear samples
+    normals = normals[valid] / norms[valid, None]
+    offsets = -np.einsum('ij,ij->i', normals, samples[valid, 0])
+    if normals.shape[0] == 0: # all samples were degenerate
+        return None
+
+    eval_points = points[rng.choice(points.shape[0], size=min(n_eval, points.shape[0]), replace=False)]
+    scores = np.empty(normals.shape[0], dtype=np.int64)
+    for start in range(0, normals.shape[0], batch_size):
+        distances = np.abs(eval_points @ normals[start:start + batch_size].T + offsets[start:start + batch_size])
+        scores[start:start + batch_size] = np.count_nonzero(distances < threshold, axis=0)
+
+    best = np.argmax(scores)
+    mask = np.abs(points @ normals[best] + offsets[best]) < threshold
+    if np.count_nonzero(mask) < 3:
+        return None
+    normal, offset = fit_plane(points[mask])
+    mask = np.abs(points @ normal + offset) < threshold
+    if np.count_nonzero(mask) < 3:
+        return None
+    return normal, offset, mask
+
+
+def plane_summary(points):
+    # centroid, (biased) covariance and number of points, enough to recover X^T X of the homogeneous points
+    points = np.asarray(points, dtype=np.float64)
+    centroid = points.mean(axis=0)
+    centered = points - centroid
+    covariance = centered.T @ centered / points.shape[0]
+    return centroid, covariance, points.shape[0]
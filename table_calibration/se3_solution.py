@@ -0,0 +1,126 @@
+# Nonlinear point-to-plane solution of the table calibration. Instead of fitting an unconstrained 3x4 matrix P
+# and forcing it into a rotation afterwards, we optimize the camera pose P = [R | t] directly on SE(3) with
+# Levenberg-Marquardt, minimizing sum_i (n_i^T (R p_i + t - c_i))^2 (same notation as linearized_solution.py).
+# We perturb R from the left, R <- exp([w]) R and t <- t + v, which gives the analytic Jacobian of a residual
+#   dr_i/dw = (R p_i) x n_i = -[n_i]_x R p_i,  dr_i/dv = n_i.
+# Both the residual and its Jacobian are linear in the homogeneous point x_i = (p_i, 1) with coefficients
+# that only depend on the pose: r_i = a^T x_i and J_i = G x_i. Hence J^T J, J^T r and the cost only need
+# the 4x4 moment matrices M = X^T X of each pose and are evaluated for all poses with one einsum, so an
+# iteration costs the same for thousands or millions of points. The solve is warm-started from the linear solution.
+
+import time
+import numpy as np
+import robotic as ry
+from scipy.spatial.transform import Rotation
+from linearized_solution import DATA_FILE, iterate_poses, iterate_plane_summaries, homogeneous_moments, \
+    summary_moments, solve_from_moments, get_Q
+
+
+SOURCE = 'points' # 'points' to use the full pointclouds, 'plane' to use the per pose plane summaries
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-10 # stop once the step norm is below this
+
+
+def skew(v):
+    # stacked cross product matrices [v]_x for v of shape (..., 3)
+    S = np.zeros(v.shape[:-1] + (3, 3))
+    S[..., 0, 1], S[..., 0, 2] = -v[..., 2], v[..., 1]
+    S[..., 1, 0], S[..., 1, 2] = v[..., 2], -v[..., 0]
+    S[..., 2, 0], S[..., 2, 1] = -v[..., 1], v[..., 0]
+    return S
+
+
+def project_to_se3(P):
+    # closest rotation to P[:, :3] in Frobenius norm, used to warm start from the linear solution
+    U, _, Vt = np.linalg.svd(P[:, :3])
+    R = U @ np.diag([1, 1, np.linalg.det(U @ Vt)]) @ Vt
+    return R, P[:, 3].copy()
+
+
+def residual_coefficients(n, c, R, t):
+    # r_i = a^T x_i with a = (R^T n, n^T (t - c)) per pose
+    return np.hstack([n @ R, np.einsum('ij,ij->i', n, t[None, :] - c)[:, None]])
+
+
+def jacobian_coefficients(n, R):
+    # J_i = G x_i with G = [[-[n]_x R, 0], [0, n]] per pose, shape (poses, 6, 4)
+    G = np.zeros((n.shape[0], 6, 4))
+    G[:, :3, :3] = -skew(n) @ R
+    G[:, 3:, 3] = n
+    return G
+
+
+def cost(n, c, M, R, t):
+    a = residual_coefficients(n, c, R, t)
+    return np.einsum('pi,pij,pj->', a, M, a)
+
+
+def solve_se3(n, c, M, R, t, max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    # Levenberg-Marquardt on the stacked per pose moments M (poses, 4, 4)
+    start = time.perf_counter()
+    damping = 1e-3
+    current_cost = cost(n, c, M, R, t)
+    iterations = 0
+    for iterations in range(1, max_iterations + 1):
+        a = residual_coefficients(n, c, R, t)
+        G = jacobian_coefficients(n, R)
+        GM = G @ M
+        JtJ = np.einsum('pik,pjk->ij', GM, G)
+        Jtr = np.einsum('pik,pk->i', GM, a)
+
+        while True:
+            step = np.linalg.solve(JtJ + damping * np.diag(np.diag(JtJ) + 1e-12), -Jtr)
+            R_new = Rotation.from_rotvec(step[:3]).as_matrix() @ R
+            t_new = t + step[3:]
+            new_cost = cost(n, c, M, R_new, t_new)
+            if new_cost <= current_cost:
+                damping = max(damping / 10, 1e-12)
+                break
+            damping *= 10
+            if damping > 1e12:
+                break
+
+        if new_cost > current_cost:
+            break # no further decrease possible
+        R, t, current_cost = R_new, t_new, new_cost
+        if np.linalg.norm(step) < tolerance:
+            break
+
+    info = {
+        'iterations': iterations,
+        'cost': current_cost,
+        'rms': np.sqrt(current_cost / M[:, 3, 3].sum()),
+        'time': time.perf_counter() - start
+    }
+    return R, t, info
+
+
+def main():
+    C = ry.Config()
+    C.addFile(ry.raiPath("scenarios/pandaSingle_camera.g"))
+
+    start = time.perf_counter()
+    if SOURCE == 'points':
+        poses = [(n, c, homogeneous_moments(points)) for n, c, points in iterate_poses(C, DATA_FILE)]
+    elif SOURCE == 'plane':
+        poses = [(n, c, summary_moments(m, S, k)) for n, c, m, S, k in iterate_plane_summaries(C, DATA_FILE)]
+    else:
+        raise ValueError("Invalid SOURCE option")
+    n = np.array([pose[0] for pose in poses])
+    c = np.array([pose[1] for pose in poses])
+    M = np.array([pose[2] for pose in poses])
+    print(f'loaded {n.shape[0]} poses with {int(M[:, 3, 3].sum())} points in {time.perf_counter() - start:.3f}s')
+
+    R, t = project_to_se3(solve_from_moments(zip(n, c, M)))
+    print(f'linear warm start: rms point to plane distance {np.sqrt(cost(n, c, M, R, t) / M[:, 3, 3].sum()):.6f}m')
+
+    R, t, info = solve_se3(n, c, M, R, t)
+    print(f"converged after {info['iterations']} iterations in {info['time'] * 1e3:.2f}ms, "
+          f"rms point to plane distance {info['rms']:.6f}m")
+
+    Q = get_Q(np.hstack([R, t[:, None]]))
+    print(Q)
+
+
+if __name__ == '__main__':
+    main()
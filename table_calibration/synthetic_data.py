@@ -0,0 +1,124 @@
+# Synthetic calibration data with a known camera pose, for benchmarking and testing the solvers. Poses follow
+# look_with_angle (common/pose_planner.py): a target on the table is sampled within the bounds of
+# automatic_data_collection.py and the camera sits at a random distance and angle from the vertical above it,
+# looking at the target with a random azimuth and roll. The gripper pose follows from the camera pose and the true
+# camera in gripper transform CAMERA_Q.
+#   table_poses yields (n, c, points) per pose as iterate_poses in linearized_solution.py: table normal and point in
+#   the gripper frame and points of the table around the target in the camera frame with depth noise
+#   table_dataset stores them in the grouped layout of load_data (n, c, points, offsets)
+#   marker_dataset gives correspondences as in old solution/calibration_data.csv: marker positions in the camera
+#   frame (noisy) and in the gripper frame
+# Usage:
+#   n, c, points, offsets = table_dataset(np.random.default_rng(0), 20, 100_000)
+#   R, t = project_to_se3(solve_by_lin_derivative(n, c, points, offsets))
+#   rotation_error, translation_error = pose_error(R, t)
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+
+CAMERA_Q = [0.05, 0.01, 0.04, 0.707107, 0, 0, -0.707107] # camera in the gripper frame [x, y, z, qw, qx, qy, qz]
+TABLE_HEIGHT = .6
+X_BOUNDS = (-.5, .5) # target bounds, min / max distance and angle as in automatic_data_collection.py
+Y_BOUNDS = (.1, .5)
+MIN_DISTANCE = .2
+MAX_DISTANCE = .5
+MIN_ANGLE = 0
+MAX_ANGLE = 4/5 * 1/2 * np.pi
+VIEW_RADIUS = .5 # points are sampled on the table within VIEW_RADIUS * distance around the target
+DEPTH_NOISE = .002 # standard deviation of the depth in m
+MARKER_NOISE = .002 # standard deviation of the marker positions in m
+
+
+def transform(Q):
+    # rai pose [x, y, z, qw, qx, qy, qz] -> 4x4 transform
+    T = np.eye(4)
+    T[:3, :3] = Rotation.from_quat(np.roll(Q[3:], -1)).as_matrix()
+    T[:3, 3] = Q[:3]
+    return T
+
+
+def sample_cameras(rng, n_poses):
+    # (K, 4, 4) camera poses in the world frame, their targets (K, 3) and distances (K,)
+    targets = np.column_stack([rng.uniform(*X_BOUNDS, n_poses), rng.uniform(*Y_BOUNDS, n_poses),
+                               np.full(n_poses, TABLE_HEIGHT)])
+    distances = rng.uniform(MIN_DISTANCE, MAX_DISTANCE, n_poses)
+    angles = rng.uniform(MIN_ANGLE, MAX_ANGLE, n_poses)
+    azimuths, rolls = rng.uniform(-np.pi, np.pi, (2, n_poses))
+    # the camera looks along its -z axis at the target, so z points from the target to the camera
+    z = np.column_stack([np.sin(angles) * np.cos(azimuths), np.sin(angles) * np.sin(azimuths), np.cos(angles)])
+    x = np.cross([0, 0, 1], z)
+    x[np.linalg.norm(x, axis=1) < 1e-9] = [1, 0, 0]
+    x /= np.linalg.norm(x, axis=1)[:, None]
+    y = np.cross(z, x)
+    R = np.stack([x, y, z], axis=2) @ Rotation.from_euler('z', rolls[:, None]).as_matrix()
+    T = np.tile(np.eye(4), (n_poses, 1, 1))
+    T[:, :3, :3] = R
+    T[:, :3, 3] = targets + distances[:, None] * z
+    return T, targets, distances
+
+
+def sample_table(rng, target, distance, n_points):
+    # (n_points, 3) points of the table plane around the target in the world frame
+    r = VIEW_RADIUS * distance * np.sqrt(rng.random(n_points))
+    phi = rng.uniform(-np.pi, np.pi, n_points)
+    return np.column_stack([target[0] + r * np.cos(phi), target[1] + r * np.sin(phi), np.full(n_points, target[2])])
+
+
+def split_counts(n_points, n_poses):
+    counts = np.full(n_poses, n_points // n_poses)
+    counts[:n_points % n_poses] += 1
+    return counts
+
+
+def table_poses(rng, n_poses, points_per_pose, noise=DEPTH_NOISE, camera_Q=CAMERA_Q):
+    # yields (n, c, points) per pose, only one pose is held in memory at a time. points_per_pose is a number or
+    # one number per pose.
+    cameras, targets, distances = sample_cameras(rng, n_poses)
+    camera_in_gripper = transform(np.asarray(camera_Q, dtype=np.float64))
+    counts = np.broadcast_to(points_per_pose, n_poses)
+    for T_camera, target, distance, count in zip(cameras, targets, distances, counts):
+        T_gripper = T_camera @ np.linalg.inv(camera_in_gripper)
+        R_gripper, t_gripper = T_gripper[:3, :3], T_gripper[:3, 3]
+        n = R_gripper.T @ [0, 0, 1]
+        c = R_gripper.T @ (np.array([0, 0, TABLE_HEIGHT]) - t_gripper)
+        points = (sample_table(rng, target, distance, count) - T_camera[:3, 3]) @ T_camera[:3, :3]
+        # depth noise along the viewing ray
+        points *= 1 + rng.normal(0, noise, count)[:, None] / -points[:, 2:]
+        yield n, c, points.astype(np.float32)
+
+
+def table_dataset(rng, n_poses, n_points, noise=DEPTH_NOISE, camera_Q=CAMERA_Q):
+    # n_points split evenly over the poses in the grouped layout of load_data, (K, 3), (K, 3), (N, 3), (K + 1,)
+    counts = split_counts(n_points, n_poses)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    n, c = np.empty((n_poses, 3)), np.empty((n_poses, 3))
+    points = np.empty((n_points, 3), dtype=np.float32)
+    for j, (n_j, c_j, points_j) in enumerate(table_poses(rng, n_poses, counts, noise, camera_Q)):
+        n[j], c[j] = n_j, c_j
+        points[offsets[j]:offsets[j + 1]] = points_j
+    return n, c, points, offsets
+
+
+def marker_dataset(rng, n_poses, n_markers, noise=MARKER_NOISE, camera_Q=CAMERA_Q):
+    # n_markers marker positions split over the poses, (N, 3) in the camera frame with noise and (N, 3) in the
+    # gripper frame
+    cameras, targets, distances = sample_cameras(rng, n_poses)
+    camera_in_gripper = transform(np.asarray(camera_Q, dtype=np.float64))
+    counts = split_counts(n_markers, n_poses)
+    X, Y = np.empty((n_markers, 3)), np.empty((n_markers, 3))
+    start = 0
+    for T_camera, target, distance, count in zip(cameras, targets, distances, counts):
+        markers = sample_table(rng, target, distance, count)
+        X[start:start + count] = (markers - T_camera[:3, 3]) @ T_camera[:3, :3]
+        Y[start:start + count] = X[start:start + count] @ camera_in_gripper[:3, :3].T + camera_in_gripper[:3, 3]
+        start += count
+    X += rng.normal(0, noise, X.shape)
+    return X, Y
+
+
+def pose_error(R, t, camera_Q=CAMERA_Q):
+    # rotation error in deg and translation error in m of a solution P = [R | t] (camera in gripper)
+    camera_in_gripper = transform(np.asarray(camera_Q, dtype=np.float64))
+    rotation = Rotation.from_matrix(R @ camera_in_gripper[:3, :3].T).magnitude()
+    return np.degrees(rotation), np.linalg.norm(t - camera_in_gripper[:3, 3])